@@ -21,7 +21,7 @@ def main():
         # annotate
         photolist.get_annotations()
         for t in photolist.photos:
-            print('{}: {}'.format(t.remote_url, ", ".join([a.description for a in t.annotation.label_annotations])))
+            print('{}: {}'.format(t.remote_url, ", ".join(t.labels)))
         # video
         videopath = video.generate_video(photos=photolist, name='video1.mp4', size='1080x720', shell=True, interval=3)
         print(videopath)
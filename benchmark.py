@@ -0,0 +1,214 @@
+#!/usr/bin/env python
+"""
+Micro-benchmarks for TweetPI. Run `python benchmark.py --help` for the list.
+"""
+import argparse
+import os
+import subprocess
+import sys
+import time
+
+DUMMY_OPTIONS = {"twitter_consumer_key": "x", "twitter_consumer_secret": "x", "twitter_access_token": "x",
+                 "twitter_access_secret": "x", "google_key_json": "gapi.json"}
+
+
+def timed(func, repeat):
+    """Best wall time of func over repeat runs, in milliseconds"""
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        elapsed = (time.perf_counter() - start) * 1000
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def bench_startup(args):
+    """Cold start of `import tweetpi` and of a DB-only command, in fresh interpreters"""
+    here = os.path.dirname(os.path.abspath(__file__))
+    snippets = [
+        ("import tweetpi", "import tweetpi"),
+        ("TweetPI() + get_total_by_type", "import tweetpi; tweetpi.TweetPI({!r}).db_client.get_total_by_type()".format(DUMMY_OPTIONS)),
+    ]
+    for label, code in snippets:
+        ms = timed(lambda: subprocess.run([sys.executable, "-c", code], cwd=here, check=True), args.repeat)
+        print("{:>32} {:>10.1f} ms".format(label, ms))
+
+
+# media JSON as returned by Twitter in extended_entities
+SAMPLE_MEDIA_JSON = {
+    "id": 1068200000000000000, "id_str": "1068200000000000000", "indices": [95, 118],
+    "media_url": "http://pbs.twimg.com/media/DtGuhfXU0AAXsQI.jpg",
+    "media_url_https": "https://pbs.twimg.com/media/DtGuhfXU0AAXsQI.jpg",
+    "url": "https://t.co/ko1rUaUMbu", "display_url": "pic.twitter.com/ko1rUaUMbu",
+    "expanded_url": "https://twitter.com/user/status/1068200000000000000/photo/1", "type": "photo",
+    "sizes": {"thumb": {"w": 150, "h": 150, "resize": "crop"}, "large": {"w": 1200, "h": 900, "resize": "fit"},
+              "medium": {"w": 1200, "h": 900, "resize": "fit"}, "small": {"w": 680, "h": 510, "resize": "fit"}},
+    "text": "Popper https://t.co/vAjZnAxlfR https://t.co/ko1rUaUMbu https://t.co/RA89Finb8P",
+}
+
+
+def bench_photo_memory(args):
+    """Memory held per Photo, with and without the raw media JSON kept"""
+    import copy
+    import gc
+    import tracemalloc
+    import tweetpi
+
+    class Label:
+        def __init__(self, description, score):
+            self.description, self.score = description, score
+
+    class Response:
+        label_annotations = [Label(d, 0.9 - i * 0.05) for i, d in enumerate(
+            ["text", "cartoon", "person", "font", "black and white", "human behavior", "emotion", "line", "product", "drawing"])]
+
+    for keep in (True, False):
+        tpi = tweetpi.TweetPI(dict(DUMMY_OPTIONS, keep_tweet_json=keep))
+        gc.collect()
+        tracemalloc.start()
+        baseline = tracemalloc.get_traced_memory()[0]
+        photos = []
+        for i in range(args.count):
+            m = copy.deepcopy(SAMPLE_MEDIA_JSON)
+            m["id"] += i
+            p = tweetpi.Photo(parent=tpi, tweet_json=m)
+            p.annotation = tweetpi.photo.compact_annotation(Response())
+            photos.append(p)
+        # the timeline JSON is dropped; only what the Photos hold is left
+        m = p = None
+        gc.collect()
+        size = tracemalloc.get_traced_memory()[0] - baseline
+        tracemalloc.stop()
+        print("{:>32} {:>10.0f} bytes/photo".format("keep_tweet_json={}".format(keep), size / args.count))
+        del photos
+
+
+def bench_replay(args):
+    """Timeline, download and annotate stages against recorded fixtures (see tweetpi.replay)"""
+    import shutil
+    import tempfile
+    import tweetpi
+    from tweetpi import replay
+
+    local_folder = tempfile.mkdtemp()
+    try:
+        tpi = tweetpi.TweetPI(dict(DUMMY_OPTIONS, local_folder=local_folder, conf_folder=local_folder),
+                              **replay.replay_factories(args.FIXTURES, latency=args.latency))
+        start = time.perf_counter()
+        photolist = tpi.get_timeline(username=args.timeline, page=1, limit=args.limit)
+        stages = [("get_timeline", time.perf_counter() - start)]
+        start = time.perf_counter()
+        photolist.download_all(max_workers=args.workers)
+        stages.append(("download_all", time.perf_counter() - start))
+        start = time.perf_counter()
+        photolist.fetch_annotations(max_workers=args.workers)
+        stages.append(("fetch_annotations", time.perf_counter() - start))
+        for label, seconds in stages:
+            print("{:>32} {:>10.1f} ms".format(label, seconds * 1000))
+        print("{:>32} {:>10}".format("photos", len(photolist)))
+    finally:
+        shutil.rmtree(local_folder)
+
+
+def bench_resize(args):
+    """ImOp.resize of a large JPEG into a video frame, full decode vs fast (draft + reducing_gap, reused canvas)"""
+    import tempfile
+    from PIL import Image, ImageChops, ImageStat
+    from tweetpi import ImOp
+
+    src_w, src_h = [int(i) for i in args.source.split('x')]
+    width, height = [int(i) for i in args.size.split('x')]
+    # a smooth gradient with detail, so that JPEG decoding is not trivial
+    im = Image.radial_gradient("L").resize((src_w, src_h))
+    im = Image.merge("RGB", (im, im.transpose(Image.FLIP_LEFT_RIGHT), Image.effect_noise((src_w, src_h), 40)))
+    fd, path = tempfile.mkstemp(suffix=".jpg")
+    os.close(fd)
+    try:
+        im.save(path, quality=90)
+        canvas = Image.new('RGB', (width, height))
+        results = {}
+        for label, kwargs in (("full decode", {}), ("fast", {"fast": True, "canvas": canvas})):
+            def run():
+                results[label] = ImOp(Image.open(path)).resize(width=width, height=height, **kwargs).im.copy()
+            print("{:>32} {:>10.1f} ms".format(label, timed(run, args.repeat)))
+        diff = ImageStat.Stat(ImageChops.difference(results["full decode"], results["fast"])).mean
+        print("{:>32} {:>10.2f} /255".format("mean abs difference", sum(diff) / len(diff)))
+    finally:
+        os.unlink(path)
+
+
+def bench_encode(args):
+    """Encoding a slideshow at 25 fps vs one frame per photo (--slideshow): encoded frames and time"""
+    import shutil
+    import tempfile
+    from PIL import Image
+    from tweetpi import video
+
+    if not shutil.which("ffmpeg") or not shutil.which("ffprobe"):
+        print("ffmpeg and ffprobe are needed", file=sys.stderr)
+        sys.exit(1)
+    width, height = [int(i) for i in args.size.split('x')]
+    frames = []
+    for i in range(args.count):
+        im = Image.effect_mandelbrot((width, height), (-2 + i * 0.01, -1.2, 1, 1.2), 50 + i).convert("RGB")
+        frames.append((None, im.tobytes()))
+    out_dir = tempfile.mkdtemp()
+    try:
+        for label, slideshow in (("25 fps", False), ("slideshow", True)):
+            name = os.path.join(out_dir, "{}.mp4".format(slideshow))
+            encoder = video.encoder_args(args.interval, slideshow, args.preset, args.crf, args.threads)
+            ms = timed(lambda: video._generate_video_from_frames(iter(frames), name, args.size, interval=args.interval,
+                                                                 encoder=encoder), args.repeat)
+            probe = subprocess.run(["ffprobe", "-v", "error", "-select_streams", "v:0", "-count_packets",
+                                    "-show_entries", "stream=nb_read_packets", "-of", "csv=p=0", name],
+                                   check=True, stdout=subprocess.PIPE, universal_newlines=True)
+            print("{:>32} {:>10.1f} ms {:>6} frames {:>10} bytes".format(
+                label, ms, probe.stdout.strip(), os.path.getsize(name)))
+    finally:
+        shutil.rmtree(out_dir)
+
+
+def main():
+    argparser = argparse.ArgumentParser(prog="benchmark.py", description="TweetPI micro-benchmarks")
+    argparser.add_argument('--repeat', help="runs per measurement, default: 5", type=int, default=5)
+    subparsers = argparser.add_subparsers(help=".")
+
+    parser_startup = subparsers.add_parser('startup', help='CLI/library startup time')
+    parser_startup.set_defaults(func=bench_startup)
+
+    parser_photo_memory = subparsers.add_parser('photo_memory', help='memory per Photo')
+    parser_photo_memory.add_argument('--count', help="photos to create, default: 10000", type=int, default=10000)
+    parser_photo_memory.set_defaults(func=bench_photo_memory)
+
+    parser_replay = subparsers.add_parser('replay', help='pipeline stages against recorded fixtures')
+    parser_replay.add_argument('FIXTURES', help="fixture folder recorded with `TweetPI.py --record`")
+    parser_replay.add_argument('--timeline', '-tl', default="__home__", help="timeline recorded, default: __home__")
+    parser_replay.add_argument('--limit', help="tweets limit used when recording")
+    parser_replay.add_argument('--latency', help="seconds added to each replayed call, default: 0", type=float, default=0)
+    parser_replay.add_argument('--workers', help="concurrent downloads and Vision requests, default: 4", type=int, default=4)
+    parser_replay.set_defaults(func=bench_replay)
+
+    parser_resize = subparsers.add_parser('resize', help='ImOp.resize, full decode vs fast')
+    parser_resize.add_argument('--source', help="source JPEG size, default: 4096x3072", default="4096x3072")
+    parser_resize.add_argument('--size', help="frame size, default: 1280x720", default="1280x720")
+    parser_resize.set_defaults(func=bench_resize)
+
+    parser_encode = subparsers.add_parser('encode', help='slideshow encoding, 25 fps vs --slideshow')
+    parser_encode.add_argument('--count', help="photos, default: 20", type=int, default=20)
+    parser_encode.add_argument('--size', help="frame size, default: 1280x720", default="1280x720")
+    parser_encode.add_argument('--interval', help="seconds per photo, default: 3", type=int, default=3)
+    parser_encode.add_argument('--preset', help="x264 preset")
+    parser_encode.add_argument('--crf', help="x264 constant rate factor", type=int)
+    parser_encode.add_argument('--threads', help="ffmpeg encoding threads", type=int)
+    parser_encode.set_defaults(func=bench_encode)
+
+    args = argparser.parse_args()
+    if 'func' not in args:
+        argparser.print_help(sys.stderr)
+        sys.exit(1)
+    args.func(args)
+
+
+if __name__ == "__main__":
+    main()
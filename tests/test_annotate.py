@@ -0,0 +1,123 @@
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+from types import SimpleNamespace
+from unittest import mock
+
+from tweetpi import TweetPI, database
+from tweetpi.photo import Photo, PhotoList
+
+
+class StubVision:
+    """
+    batch_annotate_images labelling each image with its URL; earlier batches
+    take longer, so batches complete out of order
+    """
+
+    def __init__(self, batches):
+        self.batches = batches
+        self.sizes = []
+        self.running = 0
+        self.max_running = 0
+        self._lock = threading.Lock()
+
+    def batch_annotate_images(self, requests):
+        urls = [r["image"]["source"]["image_uri"] for r in requests]
+        with self._lock:
+            index = len(self.sizes)
+            self.sizes.append(len(requests))
+            self.running += 1
+            self.max_running = max(self.max_running, self.running)
+        time.sleep(0.05 * (self.batches - index))
+        with self._lock:
+            self.running -= 1
+        return SimpleNamespace(responses=[
+            SimpleNamespace(label_annotations=[SimpleNamespace(description=url, score=0.9)]) for url in urls])
+
+
+class RecordingDB(database.NoDBClient):
+    def __init__(self):
+        super().__init__()
+        self.records = []
+
+    def batch_logs(self, data):
+        self.records.extend(data)
+
+
+class FetchAnnotationsTest(unittest.TestCase):
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.vision = StubVision(batches=4)
+        self.db = RecordingDB()
+        self.tpi = TweetPI({"twitter_consumer_key": "", "twitter_consumer_secret": "", "twitter_access_token": "",
+                            "twitter_access_secret": "", "google_key_json": "", "local_folder": self.folder},
+                           gvision_client_factory=lambda tpi: self.vision, db_client_factory=lambda tpi: self.db)
+        self.photos = PhotoList([Photo(tweet_json={"id": i, "media_url_https": "https://example.com/{}.jpg".format(i)},
+                                       parent=self.tpi) for i in range(1, 15)], parent=self.tpi)
+        patcher = mock.patch("tweetpi.photo._label_detection_type", return_value="LABEL_DETECTION")
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def tearDown(self):
+        shutil.rmtree(self.folder)
+
+    def test_concurrent_batches(self):
+        self.photos.fetch_annotations(batch_size=4, max_workers=2)
+        self.assertEqual(self.vision.sizes, [4, 4, 4, 2])
+        self.assertEqual(self.vision.max_running, 2)
+        for p in self.photos:
+            self.assertEqual(p.labels, [p.remote_url])
+        self.assertEqual(sorted((r["key"], tuple(r["keyword"])) for r in self.db.records),
+                         sorted((p.remote_url, (p.remote_url,)) for p in self.photos))
+
+    def test_not_sent_twice(self):
+        self.photos.fetch_annotations(batch_size=4, max_workers=2)
+        self.vision.sizes = []
+        photos = PhotoList([Photo(tweet_json=p.to_json(), parent=self.tpi) for p in self.photos], parent=self.tpi)
+        photos.fetch_annotations(batch_size=4, max_workers=2)
+        self.assertEqual(self.vision.sizes, [])
+        self.assertEqual([p.labels for p in photos], [[p.remote_url] for p in photos])
+
+    def test_failed_batch_doesnt_stop_logging(self):
+        respond = self.vision.batch_annotate_images
+
+        def batch_annotate_images(requests):
+            if requests[0]["image"]["source"]["image_uri"] == self.photos[4].remote_url:
+                raise RuntimeError("quota exceeded")
+            return respond(requests)
+
+        with mock.patch.object(self.vision, "batch_annotate_images", batch_annotate_images):
+            with self.assertRaises(RuntimeError):
+                self.photos.fetch_annotations(batch_size=4, max_workers=2)
+        annotated = [p for p in self.photos if p.annotation is not None]
+        self.assertEqual(len(annotated), 10)
+        self.assertEqual(sorted(r["key"] for r in self.db.records), sorted(p.remote_url for p in annotated))
+
+    def test_error_response_not_cached(self):
+        # e.g. Vision couldn't fetch one of the images
+        failing = self.photos[2].remote_url
+        respond = self.vision.batch_annotate_images
+
+        def batch_annotate_images(requests):
+            resp = respond(requests)
+            for r, response in zip(requests, resp.responses):
+                ok = r["image"]["source"]["image_uri"] != failing
+                response.error = SimpleNamespace(code=0 if ok else 14, message="" if ok else "unavailable")
+            return resp
+
+        with mock.patch.object(self.vision, "batch_annotate_images", batch_annotate_images):
+            self.photos.fetch_annotations(batch_size=4, max_workers=2)
+        self.assertIsNone(self.photos[2].annotation)
+        self.assertNotIn(self.photos[2].id, self.tpi.annotation_cache)
+        self.assertNotIn(failing, [r["key"] for r in self.db.records])
+
+        self.vision.sizes = []
+        self.photos.fetch_annotations(batch_size=4, max_workers=2)
+        self.assertEqual(self.vision.sizes, [1])
+        self.assertEqual(self.photos[2].labels, [failing])
+
+
+if __name__ == "__main__":
+    unittest.main()
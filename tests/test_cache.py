@@ -0,0 +1,99 @@
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+from tweetpi.cache import AnnotationCache, TimelineCursors
+
+
+class AnnotationCacheTest(unittest.TestCase):
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.path = os.path.join(self.folder, "annotation_cache.jsonl")
+
+    def tearDown(self):
+        shutil.rmtree(self.folder)
+
+    def test_processes_keep_each_others_labels(self):
+        a = AnnotationCache(self.path)
+        b = AnnotationCache(self.path)
+        a.put(1, [("cat", 0.9)])
+        b.put(2, [("dog", 0.8)])
+        a.save()
+        b.save()
+        # b sees what a appended after b was loaded
+        self.assertEqual(b.get(1), (("cat", 0.9),))
+        self.assertEqual(AnnotationCache(self.path).get(2), (("dog", 0.8),))
+        self.assertEqual(len(AnnotationCache(self.path)), 2)
+
+    def test_save_appends_new_entries_only(self):
+        c = AnnotationCache(self.path)
+        c.put(1, [("cat", 0.9)])
+        c.save()
+        c.put(2, [("dog", 0.8)])
+        c.save()
+        c.save()
+        with open(self.path) as fp:
+            self.assertEqual([json.loads(line)[0] for line in fp], ["1", "2"])
+
+    def test_compacts_to_max_entries(self):
+        c = AnnotationCache(self.path, max_entries=3)
+        other = AnnotationCache(self.path, max_entries=3)
+        for i in range(5):
+            c.put(i, [("n", i / 10)])
+            c.save()
+        self.assertEqual(sorted(AnnotationCache(self.path)._data), ["2", "3", "4"])
+        # a process that read the log before it was rewritten starts over
+        self.assertEqual(other.get(4), (("n", 0.4),))
+
+    def test_truncated_line_is_skipped(self):
+        with open(self.path, "w") as fp:
+            fp.write('["1", [["cat", 0.9]]]\n["2", [["do')
+        c = AnnotationCache(self.path)
+        self.assertEqual(c.get(1), (("cat", 0.9),))
+        self.assertIsNone(c.get(2))
+        c.put(3, [("owl", 0.7)])
+        c.save()
+        self.assertEqual(AnnotationCache(self.path).get(3), (("owl", 0.7),))
+
+    def test_import_json(self):
+        legacy = os.path.join(self.folder, "annotation_cache.json")
+        with open(legacy, "w") as fp:
+            json.dump({"1": [["cat", 0.9]]}, fp)
+        c = AnnotationCache(self.path)
+        c.import_json(legacy)
+        self.assertFalse(os.path.exists(legacy))
+        self.assertEqual(AnnotationCache(self.path).get(1), (("cat", 0.9),))
+
+
+class TimelineCursorsTest(unittest.TestCase):
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.path = os.path.join(self.folder, "timeline_cursors.json")
+
+    def tearDown(self):
+        shutil.rmtree(self.folder)
+
+    def test_jobs_of_other_timelines_keep_their_cursors(self):
+        a = TimelineCursors(self.path)
+        b = TimelineCursors(self.path)
+        a.update("NASA", 10, [{"id": 1}])
+        b.update("POTUS", 20, [{"id": 2}])
+        c = TimelineCursors(self.path)
+        self.assertEqual(c.get_since_id("NASA"), 10)
+        self.assertEqual(c.get_since_id("POTUS"), 20)
+        self.assertEqual(c.get_photos("NASA"), [{"id": 1}])
+
+    def test_cursor_never_moves_back(self):
+        a = TimelineCursors(self.path)
+        b = TimelineCursors(self.path)
+        a.update("NASA", 30, [{"id": 3}])
+        b.update("NASA", 20, [{"id": 2}])
+        c = TimelineCursors(self.path)
+        self.assertEqual(c.get_since_id("NASA"), 30)
+        self.assertEqual(c.get_photos("NASA"), [{"id": 2}, {"id": 3}])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,38 @@
+import copy
+import pickle
+import unittest
+
+from tweetpi.photo import Photo, PhotoList
+
+
+def photo(i):
+    return Photo(tweet_json={"id": i, "media_url_https": "https://example.com/{}.jpg".format(i)})
+
+
+class PhotoListTest(unittest.TestCase):
+    def setUp(self):
+        self.photos = PhotoList([photo(1), photo(2), photo(1), photo(3)], source="test")
+
+    def check_copy(self, c):
+        self.assertIsInstance(c, PhotoList)
+        self.assertEqual([p.id for p in c], [p.id for p in self.photos])
+        self.assertEqual(c.source, "test")
+        c.append(photo(4))
+        self.assertIn(4, c)
+        self.assertNotIn(4, self.photos)
+        self.assertEqual(c.get_by_url("https://example.com/2.jpg").id, 2)
+
+    def test_dedup(self):
+        self.assertEqual([p.id for p in self.photos], [1, 2, 3])
+
+    def test_copy(self):
+        self.check_copy(copy.copy(self.photos))
+        self.check_copy(self.photos.copy())
+        self.check_copy(copy.deepcopy(self.photos))
+
+    def test_pickle(self):
+        self.check_copy(pickle.loads(pickle.dumps(self.photos)))
+
+
+if __name__ == "__main__":
+    unittest.main()
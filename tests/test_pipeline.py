@@ -0,0 +1,80 @@
+import random
+import threading
+import time
+import unittest
+
+from tweetpi.pipeline import Pipeline, Stage
+
+
+def sleepy(i):
+    time.sleep(random.random() / 200)
+    return i
+
+
+class PipelineTest(unittest.TestCase):
+    def test_order_kept(self):
+        pl = Pipeline([Stage("a", sleepy, workers=4), Stage("b", lambda i: i * 2, workers=3)], queue_size=4)
+        self.assertEqual(list(pl.run(range(100))), [i * 2 for i in range(100)])
+        self.assertEqual(pl.errors, [])
+        self.assertEqual(pl.get_timings()["b"]["items"], 100)
+
+    def test_batch_stage(self):
+        sizes = []
+
+        def batch(items):
+            sizes.append(len(items))
+            return [i + 1 for i in items]
+
+        pl = Pipeline([Stage("a", sleepy, workers=4), Stage("batch", batch, batch_size=8)])
+        self.assertEqual(list(pl.run(range(50))), list(range(1, 51)))
+        self.assertTrue(all(0 < s <= 8 for s in sizes))
+
+    def test_failing_stage(self):
+        def odd_fails(i):
+            if i % 2:
+                raise ValueError(i)
+            return i
+
+        pl = Pipeline([Stage("a", sleepy, workers=4), Stage("check", odd_fails, workers=2), Stage("c", sleepy)])
+        self.assertEqual(list(pl.run(range(20))), list(range(0, 20, 2)))
+        self.assertEqual(sorted(i for stage, i, e in pl.errors), list(range(1, 20, 2)))
+        self.assertTrue(all(stage == "check" and isinstance(e, ValueError) for stage, i, e in pl.errors))
+
+    def test_failing_source(self):
+        def source():
+            yield from range(5)
+            raise IOError("timeline unavailable")
+
+        pl = Pipeline([Stage("a", sleepy, workers=2)], source_name="fetch")
+        self.assertEqual(list(pl.run(source())), list(range(5)))
+        self.assertEqual([(stage, i) for stage, i, e in pl.errors], [("fetch", 5)])
+
+    def test_early_close(self):
+        processed = []
+        pl = Pipeline([Stage("a", lambda i: processed.append(i) or i, workers=2)], queue_size=2)
+        threads = threading.active_count()
+        results = pl.run(range(1000000))
+        self.assertEqual(next(results), 0)
+        results.close()
+        # workers are joined, and nothing ran far ahead of the consumer
+        self.assertEqual(threading.active_count(), threads)
+        self.assertLess(len(processed), 20)
+
+    def test_slow_head_bounds_in_flight(self):
+        started = []
+
+        def slow_first(i):
+            started.append(i)
+            if i == 0:
+                time.sleep(0.3)
+            return i
+
+        pl = Pipeline([Stage("a", slow_first, workers=4)], queue_size=2, max_in_flight=8)
+        results = pl.run(range(1000))
+        self.assertEqual(next(results), 0)
+        self.assertLessEqual(len(started), 8 + 1)
+        self.assertEqual(list(results), list(range(1, 1000)))
+
+
+if __name__ == "__main__":
+    unittest.main()
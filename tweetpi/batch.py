@@ -0,0 +1,135 @@
+"""
+Build the videos of many timelines in one process. Jobs share the TweetPI
+clients and caches, a photo in several timelines is downloaded and annotated
+once, and the number of concurrent ffmpeg processes is capped, e.g.
+
+    jobs = [batch.VideoJob("POTUS"), batch.VideoJob("NASA", annotated=True)]
+    for result in batch.run_batch(tpi, jobs, max_jobs=4, max_ffmpeg=2):
+        print(result)
+"""
+import os
+import sys
+import json
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from tweetpi import video
+from tweetpi.photo import PhotoList
+
+
+class VideoJob:
+    """
+    Video of one timeline; options are passed to video.generate_video, or to
+    video.generate_annotated_video if annotated.
+    """
+
+    def __init__(self, timeline, output=None, annotated=False, limit=None, page=1, **options):
+        self.timeline = timeline
+        self.output = output
+        self.annotated = annotated
+        self.limit = limit
+        self.page = page
+        self.options = options
+
+    @classmethod
+    def from_json(cls, data):
+        """A timeline name, or an object of VideoJob arguments"""
+        if isinstance(data, str):
+            return cls(data)
+        return cls(**data)
+
+    def __str__(self):
+        return self.timeline
+
+
+class JobResult:
+    """Outcome of a VideoJob: path of its video, or the error it failed with"""
+
+    def __init__(self, job):
+        self.job = job
+        self.path = None
+        self.error = None
+        self.seconds = 0.0
+
+    @property
+    def ok(self):
+        return self.error is None and bool(self.path)
+
+    def __str__(self):
+        if self.ok:
+            return "{}: {} ({:.1f}s)".format(self.job, self.path, self.seconds)
+        return "{}: failed: {} ({:.1f}s)".format(self.job, self.error or "no video generated", self.seconds)
+
+
+def load_jobs(path):
+    """VideoJobs from a JSON file holding a list of VideoJob.from_json items"""
+    with open(path, "r") as fp:
+        return [VideoJob.from_json(data) for data in json.load(fp)]
+
+
+def _run_job(tpi, job, photos, result, shell):
+    start = time.perf_counter()
+    try:
+        if job.annotated:
+            generate = video.generate_annotated_video
+        else:
+            generate = video.generate_video
+        result.path = generate(photos, name=job.output, parent=tpi, shell=shell, **job.options)
+    except Exception as e:
+        result.error = e
+    finally:
+        result.seconds += time.perf_counter() - start
+
+
+def run_batch(tpi, jobs, max_jobs=4, max_ffmpeg=2, max_downloads=8, shell=False):
+    """
+    Run jobs, up to max_jobs at a time with at most max_ffmpeg ffmpeg
+    processes in total. Timelines are fetched first; photos are then
+    downloaded with max_downloads workers (and annotated, for annotated jobs)
+    once for all jobs. Returns a JobResult per job, in the order of jobs;
+    failed jobs don't stop the others. A job writing the same video as an
+    earlier job fails instead of running.
+    """
+    results = [JobResult(job) for job in jobs]
+    photolists = {}
+    for i, job in enumerate(jobs):
+        start = time.perf_counter()
+        try:
+            photolists[i] = tpi.get_timeline(job.timeline, job.page, job.limit)
+        except Exception as e:
+            results[i].error = e
+        results[i].seconds += time.perf_counter() - start
+
+    outputs = {}
+    for i, photos in list(photolists.items()):
+        # the name generate_video would pick
+        output = os.path.abspath(jobs[i].output or getattr(photos, "source", "timeline")+".mp4")
+        if output in outputs:
+            results[i].error = ValueError("{} is also the output of {}".format(output, jobs[outputs[output]]))
+            del photolists[i]
+        else:
+            outputs[output] = i
+
+    # one Photo per media id, so downloads and annotations are shared
+    shared = PhotoList(parent=tpi).merge(*photolists.values())
+    for i, photos in photolists.items():
+        photolists[i] = PhotoList([shared.get_by_id(p.id) for p in photos], source=photos.source, parent=tpi)
+    shared.download_all(shell=shell, force=False, max_workers=max_downloads)
+    annotated = PhotoList(parent=tpi).merge(*[photos for i, photos in photolists.items() if jobs[i].annotated])
+    if len(annotated):
+        try:
+            annotated.fetch_annotations(inline=True)
+        except Exception:
+            # annotated jobs retry, and report, on their own
+            if shell:
+                print("Shared annotation failed", file=sys.stderr)
+
+    previous_slots = video._ffmpeg_slots
+    video.set_max_ffmpeg(max_ffmpeg)
+    try:
+        with ThreadPoolExecutor(max_workers=max_jobs) as executor:
+            for i, photos in photolists.items():
+                executor.submit(_run_job, tpi, jobs[i], photos, results[i], shell)
+    finally:
+        video._ffmpeg_slots = previous_slots
+    return results
@@ -0,0 +1,512 @@
+"""
+On-disk caches: files indexed by key, kept under a byte budget with LRU eviction.
+"""
+import os
+import json
+import time
+import hashlib
+import tempfile
+import threading
+from contextlib import contextmanager
+try:
+    import fcntl
+except ImportError:
+    # Windows
+    fcntl = None
+    import msvcrt
+
+
+def atomic_write_json(path, data):
+    """Write JSON to a temp file next to path, then rename it into place"""
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path) or ".", suffix=".tmp")
+    try:
+        with os.fdopen(fd, "w") as fp:
+            json.dump(data, fp)
+        os.replace(tmp_path, path)
+    except Exception:
+        os.unlink(tmp_path)
+        raise
+
+
+@contextmanager
+def file_lock(path):
+    """Hold an exclusive lock on path (created if missing) across processes"""
+    with open(path, "a+") as fp:
+        if fcntl:
+            fcntl.flock(fp, fcntl.LOCK_EX)
+        else:
+            fp.seek(0)
+            msvcrt.locking(fp.fileno(), msvcrt.LK_LOCK, 1)
+        try:
+            yield
+        finally:
+            if fcntl:
+                fcntl.flock(fp, fcntl.LOCK_UN)
+            else:
+                fp.seek(0)
+                msvcrt.locking(fp.fileno(), msvcrt.LK_UNLCK, 1)
+
+
+class FileCache:
+    """
+    Files under folder, keyed by an arbitrary string. The index file records
+    size and last access of every entry; once the total exceeds max_bytes,
+    least recently used entries are evicted. Writes go to a temp file that is
+    renamed into place, so a crash never leaves a truncated entry behind.
+    Processes may share a folder: save() merges the index on disk under a
+    lock file, and files no index knows of (e.g. left over from a crash) are
+    deleted on load once stale_after seconds old.
+    """
+    index_name = "index.json"
+    folder = None
+    max_bytes = None
+    stale_after = 24 * 3600
+
+    def __init__(self, folder, max_bytes=None):
+        self.folder = folder
+        self.max_bytes = max_bytes
+        self._lock = threading.RLock()
+        self._dirty = False
+        # key: time, for entries removed since the last save
+        self._removed = {}
+        os.makedirs(self.folder, exist_ok=True)
+        with file_lock(self._lock_path()):
+            self._index = self._load_index()
+            self._sweep()
+
+    def _lock_path(self):
+        return os.path.join(self.folder, self.index_name + ".lock")
+
+    def _load_index(self):
+        try:
+            with open(os.path.join(self.folder, self.index_name), "r") as fp:
+                return json.load(fp)
+        except (IOError, ValueError):
+            return {}
+
+    def _sweep(self):
+        known = {e["file"] for e in self._index.values()}
+        known.update([self.index_name, self.index_name + ".lock"])
+        now = time.time()
+        for name in os.listdir(self.folder):
+            if name in known:
+                continue
+            path = os.path.join(self.folder, name)
+            try:
+                if os.path.isfile(path) and now - os.path.getmtime(path) > self.stale_after:
+                    os.unlink(path)
+            except OSError:
+                pass
+
+    def _merge(self, disk):
+        """Index on disk updated with the changes of this process"""
+        index = dict(disk)
+        for key, removed in self._removed.items():
+            if key in index and index[key]["atime"] <= removed:
+                del index[key]
+        for key, entry in self._index.items():
+            if key not in disk and not os.path.exists(os.path.join(self.folder, entry["file"])):
+                # evicted by another process
+                continue
+            if key not in index or index[key]["atime"] <= entry["atime"]:
+                index[key] = entry
+        return index
+
+    def save(self):
+        with self._lock:
+            if self._dirty:
+                with file_lock(self._lock_path()):
+                    self._index = self._merge(self._load_index())
+                    self.evict()
+                    atomic_write_json(os.path.join(self.folder, self.index_name), self._index)
+                self._removed = {}
+                self._dirty = False
+
+    def filename_for(self, key, ext=""):
+        return hashlib.sha1(key.encode("utf-8")).hexdigest() + ext
+
+    def path_for(self, key, ext=""):
+        return os.path.join(self.folder, self.filename_for(key, ext))
+
+    def get_entry(self, key):
+        """Index entry of key (a dict copy), or None"""
+        with self._lock:
+            entry = self._index.get(key)
+            return dict(entry) if entry else None
+
+    def get(self, key):
+        """Path of a valid entry, updating its last access; None on miss"""
+        with self._lock:
+            entry = self._index.get(key)
+            if not entry:
+                return None
+            path = os.path.join(self.folder, entry["file"])
+            try:
+                valid = os.path.getsize(path) == entry["size"]
+            except OSError:
+                valid = False
+            if not valid:
+                self.remove(key)
+                return None
+            entry["atime"] = time.time()
+            self._dirty = True
+            return path
+
+    def update(self, key, **meta):
+        """Merge metadata into an existing entry"""
+        with self._lock:
+            if key in self._index:
+                self._index[key].update(meta)
+                self._dirty = True
+
+    @contextmanager
+    def writer(self, key, ext="", **meta):
+        """Yield a binary file; on success it becomes the entry of key"""
+        fd, tmp_path = tempfile.mkstemp(dir=self.folder, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as fp:
+                yield fp
+            self.put(key, tmp_path, ext, **meta)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.unlink(tmp_path)
+            raise
+
+    def put(self, key, src_path, ext="", **meta):
+        """Move src_path (same filesystem) into the cache as key"""
+        filename = self.filename_for(key, ext)
+        with self._lock:
+            os.replace(src_path, os.path.join(self.folder, filename))
+            entry = {"file": filename, "size": os.path.getsize(os.path.join(self.folder, filename)),
+                     "atime": time.time()}
+            entry.update(meta)
+            self._index[key] = entry
+            self._dirty = True
+            self.evict(keep=key)
+            self.save()
+        return os.path.join(self.folder, filename)
+
+    def partial_path(self, key, ext=""):
+        return self.path_for(key, ext) + ".part"
+
+    def get_partial(self, key, ext=""):
+        """(size, metadata) of an interrupted write of key, or None"""
+        part_path = self.partial_path(key, ext)
+        try:
+            with open(part_path + ".json", "r") as fp:
+                meta = json.load(fp)
+            return os.path.getsize(part_path), meta
+        except (IOError, OSError, ValueError):
+            return None
+
+    def set_partial_meta(self, key, ext="", **meta):
+        """Record metadata (e.g. HTTP validators) of a partial write next to it"""
+        atomic_write_json(self.partial_path(key, ext) + ".json", meta)
+
+    def temp_path(self):
+        """New empty file in the folder, e.g. to download into before put()"""
+        fd, tmp_path = tempfile.mkstemp(dir=self.folder, suffix=".tmp")
+        os.close(fd)
+        return tmp_path
+
+    def claim_partial(self, key, ext=""):
+        """
+        Take over the interrupted write of key: (temp path holding it, size,
+        metadata), or None. Claiming moves it away, so no other process (or
+        thread) resumes the same write.
+        """
+        with self._lock, file_lock(self._lock_path()):
+            partial = self.get_partial(key, ext)
+            if not partial:
+                return None
+            tmp_path = self.temp_path()
+            try:
+                os.replace(self.partial_path(key, ext), tmp_path)
+            except OSError:
+                os.unlink(tmp_path)
+                return None
+            self.remove_partial(key, ext)
+            return tmp_path, partial[0], partial[1]
+
+    def keep_partial(self, key, tmp_path, ext="", **meta):
+        """Keep the interrupted write of key in tmp_path for claim_partial()"""
+        with self._lock, file_lock(self._lock_path()):
+            self.set_partial_meta(key, ext, **meta)
+            os.replace(tmp_path, self.partial_path(key, ext))
+
+    def remove_partial(self, key, ext=""):
+        part_path = self.partial_path(key, ext)
+        for f in (part_path, part_path + ".json"):
+            try:
+                os.unlink(f)
+            except OSError:
+                pass
+
+    def remove(self, key):
+        with self._lock:
+            entry = self._index.pop(key, None)
+            if entry:
+                self._dirty = True
+                self._removed[key] = time.time()
+                try:
+                    os.unlink(os.path.join(self.folder, entry["file"]))
+                except OSError:
+                    pass
+
+    def total_bytes(self):
+        with self._lock:
+            return sum(e["size"] for e in self._index.values())
+
+    def evict(self, keep=None):
+        """Drop least recently used entries until the cache fits max_bytes"""
+        if not self.max_bytes:
+            return
+        with self._lock:
+            total = self.total_bytes()
+            for key in sorted(self._index, key=lambda k: self._index[k]["atime"]):
+                if total <= self.max_bytes:
+                    break
+                if key == keep:
+                    continue
+                total -= self._index[key]["size"]
+                self.remove(key)
+
+    def __contains__(self, key):
+        with self._lock:
+            return key in self._index
+
+    def __len__(self):
+        return len(self._index)
+
+
+class MediaCache(FileCache):
+    """Downloaded Twitter media, keyed by remote URL"""
+
+    def get_ext(self, url):
+        return os.path.splitext(url)[1]
+
+
+class FrameCache(FileCache):
+    """
+    Rendered video frames, keyed by photo and render parameters. Frames are
+    kept as PNG: raw RGB24 takes several MB per frame.
+    """
+
+    @staticmethod
+    def key_for(photo_id, **params):
+        return json.dumps([photo_id, params], sort_keys=True)
+
+    def get_frame(self, key, size):
+        """RGB24 bytes of a frame of size (width, height), or None"""
+        from PIL import Image
+        path = self.get(key)
+        if not path:
+            return None
+        try:
+            with Image.open(path) as im:
+                if im.size != tuple(size):
+                    raise ValueError("Frame of the wrong size")
+                return im.convert("RGB").tobytes()
+        except (IOError, OSError, ValueError):
+            # unreadable, e.g. written by an older version
+            self.remove(key)
+            return None
+
+    def put_frame(self, key, frame, size):
+        from PIL import Image
+        with self.writer(key, ".png") as fp:
+            # fast zlib level; frames are read back far more than written
+            Image.frombytes("RGB", tuple(size), frame).save(fp, "PNG", compress_level=1)
+
+
+class TimelineCursors:
+    """
+    Newest tweet id seen for each timeline, plus the media JSON of photos
+    already returned, kept in one JSON file so incremental runs can ask
+    Twitter only for tweets after since_id. Updates are merged into the file
+    under a lock file, as jobs of other timelines may share it.
+    """
+    path = None
+    known_photos_limit = 200
+
+    def __init__(self, path, known_photos_limit=None):
+        self.path = path
+        if known_photos_limit:
+            self.known_photos_limit = known_photos_limit
+        self._lock = threading.Lock()
+        self._data = self._load()
+
+    def _load(self):
+        try:
+            with open(self.path, "r") as fp:
+                return json.load(fp)
+        except (IOError, ValueError):
+            return {}
+
+    def get_since_id(self, username):
+        with self._lock:
+            return self._data.get(username, {}).get("since_id")
+
+    def get_photos(self, username):
+        """Media JSON of known photos, latest first"""
+        with self._lock:
+            return list(self._data.get(username, {}).get("photos", []))
+
+    def update(self, username, since_id, photos):
+        """Advance the cursor and prepend newly seen media JSON (latest first)"""
+        with self._lock, file_lock(self.path + ".lock"):
+            self._data = self._load()
+            cursor = self._data.setdefault(username, {"since_id": None, "photos": []})
+            if since_id and (not cursor["since_id"] or since_id > cursor["since_id"]):
+                cursor["since_id"] = since_id
+            known = {p["id"] for p in photos}
+            cursor["photos"] = (list(photos) + [p for p in cursor["photos"] if p["id"] not in known])[:self.known_photos_limit]
+            atomic_write_json(self.path, self._data)
+
+
+class AnnotationCache:
+    """
+    Vision labels ((description, score), ...) of photos already annotated,
+    keyed by media id, so that no photo is sent to Vision twice. The file is
+    a log of JSON lines: save() appends new entries under a lock file, so
+    processes sharing it keep each other's labels, and lookups missing a key
+    first read what others appended since. Once the log holds more than
+    max_entries labels it is rewritten with the most recent ones. hits and
+    misses count lookups since creation.
+    """
+    path = None
+    max_entries = 100000
+
+    def __init__(self, path, max_entries=None):
+        self.path = path
+        if max_entries:
+            self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._data = {}
+        self._pending = {}
+        self._lines = 0
+        self._offset = 0
+        self._inode = None
+        with file_lock(self.path + ".lock"):
+            self._read()
+
+    def _changed(self):
+        try:
+            st = os.stat(self.path)
+        except OSError:
+            return False
+        return st.st_ino != self._inode or st.st_size != self._offset
+
+    def _read(self):
+        """Take in the lines appended since the last read"""
+        try:
+            with open(self.path, "rb") as fp:
+                inode = os.fstat(fp.fileno()).st_ino
+                if inode != self._inode:
+                    # new, or rewritten by _compact in another process
+                    self._inode = inode
+                    self._offset = 0
+                    self._lines = 0
+                fp.seek(self._offset)
+                for line in fp:
+                    if not line.endswith(b"\n"):
+                        # being written, or cut short by a crash
+                        break
+                    self._offset += len(line)
+                    try:
+                        key, labels = json.loads(line.decode("utf-8"))
+                    except ValueError:
+                        continue
+                    self._lines += 1
+                    self._data.pop(key, None)
+                    self._data[key] = labels
+        except (IOError, OSError):
+            pass
+
+    def get(self, key):
+        key = str(key)
+        with self._lock:
+            if key not in self._data and key not in self._pending and self._changed():
+                with file_lock(self.path + ".lock"):
+                    self._read()
+            labels = self._pending.get(key, self._data.get(key))
+            if labels is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            return tuple((description, score) for description, score in labels)
+
+    def put(self, key, labels):
+        with self._lock:
+            self._pending[str(key)] = [list(l) for l in labels]
+
+    def save(self):
+        """Append the entries put since the last save"""
+        with self._lock:
+            if not self._pending:
+                return
+            with file_lock(self.path + ".lock"):
+                self._read()
+                for key, labels in self._pending.items():
+                    self._data.pop(key, None)
+                    self._data[key] = labels
+                if len(self._data) > self.max_entries or self._lines + len(self._pending) > 2 * self.max_entries:
+                    self._compact()
+                else:
+                    with open(self.path, "ab") as fp:
+                        if fp.tell() > self._offset:
+                            # end the line a crashed writer left unfinished
+                            fp.write(b"\n")
+                        for key, labels in self._pending.items():
+                            fp.write(self._line(key, labels))
+                        self._offset = fp.tell()
+                    self._lines += len(self._pending)
+                self._pending = {}
+
+    @staticmethod
+    def _line(key, labels):
+        return (json.dumps([key, labels]) + "\n").encode("utf-8")
+
+    def _compact(self):
+        # entries are in the order they were added, oldest first
+        keep = list(self._data.items())[-self.max_entries:]
+        self._data = dict(keep)
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(self.path) or ".", suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as fp:
+                for key, labels in keep:
+                    fp.write(self._line(key, labels))
+                self._offset = fp.tell()
+            os.replace(tmp_path, self.path)
+        except Exception:
+            os.unlink(tmp_path)
+            raise
+        self._inode = os.stat(self.path).st_ino
+        self._lines = len(keep)
+
+    def import_json(self, path):
+        """Take in the labels of a cache file of older versions (one JSON object), then remove it"""
+        try:
+            with open(path, "r") as fp:
+                data = json.load(fp)
+        except (IOError, OSError, ValueError):
+            # e.g. imported by another process meanwhile
+            return
+        with self._lock:
+            for key, labels in data.items():
+                if key not in self._data:
+                    self._pending[key] = labels
+        self.save()
+        try:
+            os.unlink(path)
+        except OSError:
+            pass
+
+    def __contains__(self, key):
+        with self._lock:
+            return str(key) in self._pending or str(key) in self._data
+
+    def __len__(self):
+        return len(set(self._data) | set(self._pending))
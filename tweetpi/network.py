@@ -0,0 +1,138 @@
+"""
+HTTP helpers for media downloads: keep-alive connections pooled per host.
+"""
+import base64
+import http.client
+import threading
+import urllib.request
+from contextlib import contextmanager
+from urllib.parse import unquote, urlsplit, urljoin
+
+
+class ConnectionPool:
+    """
+    Keep-alive HTTP(S) connections, one per (scheme, host) for each thread.
+    Thread-safe: every thread owns its connections, so a pool can be shared
+    by the workers of PhotoList.download_all.
+    Like urllib, goes through the proxies of HTTP(S)_PROXY, except for the
+    hosts of NO_PROXY; proxies (as from urllib.request.getproxies()) overrides
+    them.
+    """
+    timeout = 30
+    max_redirects = 5
+
+    def __init__(self, timeout=None, proxies=None):
+        if timeout:
+            self.timeout = timeout
+        self.proxies = proxies
+        self._local = threading.local()
+
+    def _connections(self):
+        if not hasattr(self._local, "conns"):
+            self._local.conns = {}
+        return self._local.conns
+
+    def _get_proxy(self, scheme, netloc):
+        """(proxy host:port, Proxy-Authorization headers), or None for a direct connection"""
+        if self.proxies is None:
+            proxies = urllib.request.getproxies()
+            bypass = urllib.request.proxy_bypass
+        else:
+            proxies = self.proxies
+            bypass = lambda host: urllib.request.proxy_bypass_environment(host, proxies)
+        proxy = proxies.get(scheme)
+        if not proxy or bypass(netloc):
+            return None
+        if "://" not in proxy:
+            proxy = "http://" + proxy
+        parts = urlsplit(proxy)
+        headers = {}
+        if parts.username is not None:
+            credentials = "{}:{}".format(unquote(parts.username), unquote(parts.password or ""))
+            headers["Proxy-Authorization"] = "Basic " + base64.b64encode(credentials.encode()).decode("ascii")
+        return parts.netloc.rpartition("@")[2], headers
+
+    def _get_connection(self, scheme, netloc):
+        """Connection to netloc, and whether it goes through an HTTP proxy"""
+        conns = self._connections()
+        key = (scheme, netloc)
+        if key not in conns:
+            if scheme not in ("http", "https"):
+                raise ValueError("Unsupported URL scheme: {}".format(scheme))
+            proxy = self._get_proxy(scheme, netloc)
+            if scheme == "https":
+                if proxy:
+                    # TLS to netloc, through a CONNECT tunnel
+                    conn = http.client.HTTPSConnection(proxy[0], timeout=self.timeout)
+                    conn.set_tunnel(netloc, headers=proxy[1])
+                else:
+                    conn = http.client.HTTPSConnection(netloc, timeout=self.timeout)
+            else:
+                conn = http.client.HTTPConnection(proxy[0] if proxy else netloc, timeout=self.timeout)
+            conns[key] = (conn, proxy[1] if proxy and scheme == "http" else None)
+        return conns[key]
+
+    def _drop_connection(self, scheme, netloc):
+        conn = self._connections().pop((scheme, netloc), None)
+        if conn:
+            conn[0].close()
+
+    def _request(self, url, headers):
+        parts = urlsplit(url)
+        path = parts.path or "/"
+        if parts.query:
+            path += "?" + parts.query
+        # a kept-alive connection may have been closed by the server; retry once
+        for retry in (True, False):
+            conn, proxy_headers = self._get_connection(parts.scheme, parts.netloc)
+            try:
+                if proxy_headers is None:
+                    conn.request("GET", path, headers=headers)
+                else:
+                    # plain HTTP proxies take the absolute URL
+                    conn.request("GET", "http://{}{}".format(parts.netloc, path), headers=dict(headers, **proxy_headers))
+                return conn.getresponse(), parts
+            except (http.client.RemoteDisconnected, http.client.CannotSendRequest,
+                    ConnectionResetError, BrokenPipeError):
+                self._drop_connection(parts.scheme, parts.netloc)
+                if not retry:
+                    raise
+
+    @contextmanager
+    def open(self, url, headers=None):
+        """
+        GET url and yield the http.client.HTTPResponse, following redirects.
+        The response should be consumed inside the with block so that the
+        connection can be reused.
+        """
+        headers = dict(headers or {})
+        for _ in range(self.max_redirects + 1):
+            response, parts = self._request(url, headers)
+            if response.status in (301, 302, 303, 307, 308) and response.getheader("Location"):
+                response.read()
+                if response.will_close:
+                    self._drop_connection(parts.scheme, parts.netloc)
+                url = urljoin(url, response.getheader("Location"))
+                continue
+            break
+        else:
+            raise Exception("Too many redirects: {}".format(url))
+
+        try:
+            yield response
+        except Exception:
+            # the body may be left unread; the connection is not reusable
+            self._drop_connection(parts.scheme, parts.netloc)
+            raise
+        else:
+            if response.will_close or not response.isclosed():
+                self._drop_connection(parts.scheme, parts.netloc)
+
+    def close(self):
+        """Close connections owned by the calling thread"""
+        for conn, _ in self._connections().values():
+            conn.close()
+        self._connections().clear()
+
+
+default_pool = ConnectionPool()
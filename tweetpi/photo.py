@@ -1,12 +1,14 @@
 import os, sys
+import io
 import shutil
-import urllib.request
 import tempfile
-from google.cloud import vision
-from PIL import Image, ImageDraw, ImageFile
 from math import floor
 import textwrap
 import uuid
+import threading
+from functools import lru_cache
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from tweetpi import network
 
 try:
     # Python 3
@@ -16,121 +18,446 @@ except ImportError:
     from collections import Mapping
 
 
+def _label_detection_type():
+    # google.cloud.vision is slow to import; only load it to build requests
+    from google.cloud import vision
+    return vision.enums.Feature.Type.LABEL_DETECTION
+
+
+def compact_annotation(response, min_score=0):
+    """Reduce a Vision AnnotateImageResponse to ((description, score), ...)"""
+    return tuple((a.description, a.score) for a in response.label_annotations if a.score >= min_score)
+
+
+# Vision rejects requests over 10 MB; keep headroom for the JSON envelope
+VISION_MAX_REQUEST_BYTES = 8 * 1024 * 1024
+
+
+def _request_size(request):
+    content = request['image'].get('content')
+    # content is base64-encoded on the wire
+    return 1024 + (len(content) * 4 // 3 if content else 0)
+
+
+def _split_batches(pending, batch_size, max_bytes):
+    """Split [(photo, request), ...] into batches of at most batch_size requests and max_bytes"""
+    batches = []
+    batch = []
+    size = 0
+    for p, r in pending:
+        r_size = _request_size(r)
+        if batch and (len(batch) >= batch_size or size + r_size > max_bytes):
+            batches.append(batch)
+            batch = []
+            size = 0
+        batch.append((p, r))
+        size += r_size
+    if batch:
+        batches.append(batch)
+    return batches
+
+
 # Thanks to https://stackoverflow.com/a/2704866/4073795
 class Photo(Mapping):
     '''
-    Inmutable, hashable
+    Inmutable, hashable. Only the fields used by the library are kept, unless
+    the parent has keep_tweet_json set; annotation is a tuple of
+    (description, score) pairs.
     '''
-    local_folder = None
-    remote_url = ""
-    local_path = None
-    name = None
-    tweet_json = None
-    parent = None
-    annotation = None
+    __slots__ = ("id", "remote_url", "text", "local_path", "name", "tweet_json", "parent", "annotation", "dhash")
+
     def __init__(self, tweet_json=None, parent=None):
         self.parent = parent
-        self.local_folder = self.parent.local_folder
-        if not self.local_folder:
-           self.local_folder = ""
+        self.id = None
+        self.remote_url = ""
+        self.text = ""
+        self.local_path = None
+        self.name = None
+        self.tweet_json = None
+        self.annotation = None
+        self.dhash = None
         if tweet_json:
             if 'id' in tweet_json:
-                self.tweet_json = tweet_json
+                self.id = tweet_json['id']
                 self.remote_url = tweet_json['media_url_https']
+                self.text = tweet_json.get('text', "")
+                if parent and parent.keep_tweet_json:
+                    self.tweet_json = tweet_json
             else:
                 raise Exception('Media json should contain id')
 
+    def to_json(self):
+        """Raw media JSON if kept, else the fields Photo needs to be rebuilt"""
+        if self.tweet_json:
+            return self.tweet_json
+        return {"id": self.id, "media_url_https": self.remote_url, "text": self.text}
+
     def __iter__(self):
-        return iter(self.tweet_json)
+        return iter(self.to_json())
 
     def __len__(self):
-        return len(self.tweet_json)
+        return len(self.to_json())
 
     def __getitem__(self, key):
-        return self.tweet_json[key]
+        return self.to_json()[key]
 
     def __hash__(self):
-        return self.tweet_json['id']
+        return self.id
+
+    def __eq__(self, other):
+        if isinstance(other, Photo):
+            return self.id == other.id
+        return Mapping.__eq__(self, other)
 
     def __str__(self):
-        return self.tweet_json.__str__()
+        return self.to_json().__str__()
+
+    @property
+    def labels(self):
+        """Annotation descriptions"""
+        return [description for description, score in self.annotation or ()]
 
     def download(self, force=False):
+        """
+        Fetch the photo into the media cache. With force, a cached copy is
+        revalidated with its ETag/Last-Modified instead of being fetched
+        again, and an interrupted download is resumed with a Range request.
+        """
         if not self.remote_url:
             raise Exception("No download URL specified")
-        local_path = os.path.join(self.local_folder, os.path.basename(self.remote_url))
-        if os.path.isfile(local_path) and not force:
+        media_cache = self.parent.media_cache
+        ext = media_cache.get_ext(self.remote_url)
+        self.name = os.path.basename(self.remote_url)
+        local_path = media_cache.get(self.remote_url)
+        if local_path and not force:
             self.local_path = local_path
             return
-        # https://stackoverflow.com/a/7244263/4073795
-        with urllib.request.urlopen(self.remote_url) as response, open(local_path, 'wb') as out_file:
-            if response.getcode() == 200:
-                try:
-                    shutil.copyfileobj(response, out_file)
-                    self.local_path = local_path
-                    self.name = os.path.basename(local_path)
-                except Exception:
-                    os.unlink(local_path)
-                    raise
-            else:
-                raise Exception("Image download with wrong HTTP code: "+response.getcode())
 
-    def get_im(self):
-        if not self.local_path:
+        headers = {}
+        offset = 0
+        tmp_path = None
+        validators = {}
+        if local_path:
+            entry = media_cache.get_entry(self.remote_url)
+            if entry.get("etag"):
+                headers["If-None-Match"] = entry["etag"]
+            if entry.get("last_modified"):
+                headers["If-Modified-Since"] = entry["last_modified"]
+        else:
+            partial = media_cache.claim_partial(self.remote_url, ext)
+            if partial:
+                tmp_path, size, meta = partial
+                validators = meta
+                if size and (meta.get("etag") or meta.get("last_modified")):
+                    offset = size
+                    headers["Range"] = "bytes={}-".format(offset)
+                    headers["If-Range"] = meta.get("etag") or meta.get("last_modified")
+        if not tmp_path:
+            # a file of this download only, as other processes sharing the
+            # cache may be downloading the same URL
+            tmp_path = media_cache.temp_path()
+
+        try:
+            # https://stackoverflow.com/a/7244263/4073795
+            while True:
+                with self.get_http_pool().open(self.remote_url, headers=headers) as response:
+                    if response.status == 304 and local_path:
+                        response.read()
+                        self.local_path = local_path
+                        return
+                    if response.status == 206 and offset and \
+                            (response.getheader("Content-Range") or "").startswith("bytes {}-".format(offset)):
+                        mode = "ab"
+                    elif response.status == 200:
+                        mode = "wb"
+                    elif offset:
+                        # the partial download can't be resumed (e.g. 416 as
+                        # it was complete already), so start over
+                        response.read()
+                        offset = 0
+                        del headers["Range"], headers["If-Range"]
+                        continue
+                    else:
+                        response.read()
+                        raise Exception("Image download with wrong HTTP code: {}".format(response.status))
+
+                    validators = {"etag": response.getheader("ETag"),
+                                  "last_modified": response.getheader("Last-Modified")}
+                    with open(tmp_path, mode) as out_file:
+                        shutil.copyfileobj(response, out_file)
+                    length = response.getheader("Content-Length")
+                    if length and os.path.getsize(tmp_path) != int(length) + (offset if mode == "ab" else 0):
+                        raise Exception("Image download interrupted: {}".format(self.remote_url))
+                break
+            self.local_path = media_cache.put(self.remote_url, tmp_path, ext, **validators)
+            tmp_path = None
+        finally:
+            if tmp_path:
+                if os.path.getsize(tmp_path) and (validators.get("etag") or validators.get("last_modified")):
+                    # kept for resuming
+                    media_cache.keep_partial(self.remote_url, tmp_path, ext, **validators)
+                else:
+                    os.unlink(tmp_path)
+
+    def get_http_pool(self):
+        if self.parent and self.parent.http_pool:
+            return self.parent.http_pool
+        return network.default_pool
+
+    def get_local_path(self):
+        """
+        Path of the downloaded photo, downloading it (again) if needed, as the
+        media cache may have evicted it since
+        """
+        if not self.local_path or not os.path.isfile(self.local_path):
             self.download()
+        return self.local_path
 
+    def get_im(self):
+        from PIL import Image
         # https://stackoverflow.com/a/44231784/4073795
-        return Image.open(self.local_path)
-
-    def get_annotation_request(self, force=False):
-        if self.annotation and not force:
+        return Image.open(self.get_local_path())
+
+    def get_dhash(self):
+        """
+        64-bit difference hash of the downloaded image; near-duplicates
+        (reposts, re-encodes) differ in only a few bits. Kept in the media
+        cache index so it is computed once per image.
+        """
+        if self.dhash is None:
+            media_cache = self.parent.media_cache
+            entry = media_cache.get_entry(self.remote_url)
+            if entry and entry.get("dhash") is not None:
+                self.dhash = entry["dhash"]
+                return self.dhash
+            from PIL import Image
+            with self.get_im() as im:
+                im.draft("L", (64, 64))
+                pixels = im.convert("L").resize((9, 8), Image.BILINEAR).tobytes()
+            bits = 0
+            for row in range(8):
+                for col in range(8):
+                    bits = (bits << 1) | (pixels[row*9+col] > pixels[row*9+col+1])
+            self.dhash = bits
+            media_cache.update(self.remote_url, dhash=bits)
+        return self.dhash
+
+    def get_annotation_request(self, force=False, inline=False, max_dimension=640, quality=85):
+        """
+        Vision request, or None if annotated already (in memory or in the
+        annotation cache). With inline, the image content is sent as a JPEG
+        downscaled to max_dimension from the local copy, instead of letting
+        Vision fetch the full-size image from Twitter.
+        """
+        if self.annotation is not None and not force:
+            return None
+        if not force and self.load_cached_annotation():
             return None
 
+        image = None
+        if inline:
+            try:
+                image = {'content': self.get_inline_content(max_dimension, quality)}
+            except Exception:
+                # fall back to letting Vision fetch it
+                image = None
         return {
-            'image':{'source': {'image_uri': self.remote_url}},
-            'features': [{'type': vision.enums.Feature.Type.LABEL_DETECTION}]
+            'image': image or {'source': {'image_uri': self.remote_url}},
+            'features': [{'type': _label_detection_type()}]
         }
 
+    def get_inline_content(self, max_dimension=640, quality=85):
+        """JPEG bytes of the image, fitting in max_dimension x max_dimension"""
+        from PIL import Image
+        with self.get_im() as im:
+            im.draft("RGB", (max_dimension, max_dimension))
+            im = im.convert("RGB")
+            im.thumbnail((max_dimension, max_dimension), Image.LANCZOS)
+            buf = io.BytesIO()
+            im.save(buf, "JPEG", quality=quality)
+        return buf.getvalue()
+
+    def _apply_labels(self, labels):
+        min_score = self.parent.annotation_min_score
+        self.annotation = tuple(l for l in labels if l[1] >= min_score)
+
+    def load_cached_annotation(self):
+        labels = self.parent.annotation_cache.get(self.id)
+        if labels is None:
+            return False
+        self._apply_labels(labels)
+        return True
+
+    def set_annotation(self, response):
+        """
+        Keep a Vision response, also storing it in the annotation cache.
+        Returns False, leaving the photo unannotated so it is sent again
+        next time, if Vision failed on it (e.g. couldn't fetch the image).
+        """
+        error = getattr(response, "error", None)
+        if error is not None and error.code:
+            print("Vision failed on {}: {}".format(self.remote_url, error.message), file=sys.stderr)
+            return False
+        labels = compact_annotation(response)
+        self.parent.annotation_cache.put(self.id, labels)
+        self._apply_labels(labels)
+        return True
+
     def get_annotation(self):
-        if not self.annotation:
+        if self.annotation is None:
             req = self.get_annotation_request()
             if not req:
-                return False
+                return self.annotation
 
-            self.annotation = self.parent.gvision_client.annotate_image(req)
-            self.parent.db_client.log(type="annotate", keyword=[a.description for a in self.annotation.label_annotations],
-                               key=self.remote_url, text=self.tweet_json['text'], metadata={})
+            if not self.set_annotation(self.parent.gvision_client.annotate_image(req)):
+                return None
+            self.parent.annotation_cache.save()
+            self.parent.db_client.log(type="annotate", keyword=self.labels,
+                               key=self.remote_url, text=self.text, metadata={})
 
         return self.annotation
 
 class PhotoList(list):
+    """
+    List of unique Photos in insertion order, indexed by media id and URL.
+    Adding a photo whose id is already in the list is a no-op.
+    """
     source = "unknown"
     parent = None
 
-    def __init__(self, photos, source="", parent=None):
-        photos = [o for o in set(photos)]
-        # unifiy photos
+    def __init__(self, photos=(), source="", parent=None):
+        # unifiy photos, keeping the first of each id
+        self._by_id = {}
+        self._by_url = {}
         self.parent = parent
         if source:
             self.source = source
-        super(PhotoList, self).__init__(photos)
+        super(PhotoList, self).__init__()
+        self.extend(photos)
+
+    def _index(self, p):
+        self._by_id[p.id] = p
+        self._by_url[p.remote_url] = p
+
+    def _unindex(self, p):
+        self._by_id.pop(p.id, None)
+        self._by_url.pop(p.remote_url, None)
+
+    def _reindex(self):
+        unique = []
+        self._by_id = {}
+        self._by_url = {}
+        for p in list.__iter__(self):
+            if p.id not in self._by_id:
+                self._index(p)
+                unique.append(p)
+        if len(unique) != len(self):
+            list.__setitem__(self, slice(None), unique)
+
+    def get_by_id(self, id, default=None):
+        return self._by_id.get(id, default)
+
+    def get_by_url(self, url, default=None):
+        return self._by_url.get(url, default)
+
+    def __contains__(self, p):
+        """Photo, or media id"""
+        return (p.id if isinstance(p, Photo) else p) in self._by_id
+
+    def append(self, p):
+        if p.id not in self._by_id:
+            super(PhotoList, self).append(p)
+            self._index(p)
+
+    def extend(self, photos):
+        for p in photos:
+            self.append(p)
+
+    def insert(self, i, p):
+        if p.id not in self._by_id:
+            super(PhotoList, self).insert(i, p)
+            self._index(p)
+
+    def remove(self, p):
+        super(PhotoList, self).remove(p)
+        self._unindex(p)
+
+    def pop(self, i=-1):
+        p = super(PhotoList, self).pop(i)
+        self._unindex(p)
+        return p
+
+    def clear(self):
+        super(PhotoList, self).clear()
+        self._by_id = {}
+        self._by_url = {}
+
+    def __setitem__(self, i, value):
+        super(PhotoList, self).__setitem__(i, value)
+        self._reindex()
+
+    def __delitem__(self, i):
+        super(PhotoList, self).__delitem__(i)
+        self._reindex()
+
+    def __iadd__(self, photos):
+        self.extend(photos)
+        return self
+
+    def __add__(self, photos):
+        return self.merge(photos)
+
+    def merge(self, *photolists):
+        """New PhotoList with the photos of self followed by the new ones of photolists"""
+        merged = PhotoList(self, source=self.source, parent=self.parent)
+        for photos in photolists:
+            merged.extend(photos)
+        return merged
+
+    def copy(self):
+        return PhotoList(self, source=self.source, parent=self.parent)
+
+    __copy__ = copy
 
-    def download_all(self, shell=False, force=True):
-        completed = 0
-        successful = True
+    def __reduce__(self):
+        # rebuild the indexes, rather than restoring them before the items
+        return (self.__class__, (list(self), self.source, self.parent))
+
+    def download_all(self, shell=False, force=True, max_workers=1):
+        """
+        Download every photo, with up to max_workers concurrent downloads
+        sharing keep-alive connections. Returns False if any download failed.
+        """
+        lock = threading.Lock()
+        state = {"completed": 0, "successful": True}
         total = len(self)
         if shell:
             print("{} items to be downloaded".format(total), file=sys.stderr)
-        for p in self:
-            completed += 1
+
+        def _download(p):
             try:
                 p.download(force=force)
-                if shell:
-                    print("({}/{}) Downloaded: {}".format(completed, total, p.remote_url), file=sys.stderr)
+                ok = True
             except Exception:
-                print("({}/{}) Failed: {}".format(completed, total, p.remote_url), file=sys.stderr)
-                successful = False
-        return successful
+                ok = False
+            with lock:
+                state["completed"] += 1
+                if not ok:
+                    state["successful"] = False
+                    print("({}/{}) Failed: {}".format(state["completed"], total, p.remote_url), file=sys.stderr)
+                elif shell:
+                    print("({}/{}) Downloaded: {}".format(state["completed"], total, p.remote_url), file=sys.stderr)
+
+        if max_workers > 1 and total > 1:
+            with ThreadPoolExecutor(max_workers=min(max_workers, total)) as executor:
+                list(executor.map(_download, self))
+        else:
+            for p in self:
+                _download(p)
+        if self.parent:
+            # persist last access times of cache hits
+            self.parent.media_cache.save()
+        return state["successful"]
 
     def get_list(self):
         """@deprecated"""
@@ -143,40 +470,130 @@ class PhotoList(list):
 
     photos = property(get_list, set_photos)
 
-    def fetch_annotations(self):
-        # figure out what shoule be requested
-        photolist = []
-        requests = []
+    def find_near_duplicates(self, max_distance=4):
+        """
+        Group photos whose dHash differ in at most max_distance bits, in list
+        order; the first photo of each group is its representative. Photos
+        that can't be downloaded form groups of their own.
+        """
+        # pigeonhole: hashes within max_distance share at least one of
+        # max_distance+1 bands exactly, so only same-band photos are compared
+        bands = max_distance + 1
+        band_bits = [(64 * i // bands, 64 * (i + 1) // bands) for i in range(bands)]
+        buckets = [{} for _ in range(bands)]
+        groups = []
         for p in self:
-            r = p.get_annotation_request()
-            if r:
-                photolist.append(p)
-                requests.append(r)
-
-        # request
-        while len(requests):
-            assert len(requests) == len(photolist)
-            resp = self.parent.gvision_client.batch_annotate_images(requests[0:16])
-            assert len(resp.responses) <= len(photolist)
-            completed_photolist = []
-            for r in resp.responses:
-                p = photolist.pop(0)
-                p.annotation = r
-                completed_photolist.append(p)
-            self.parent.db_client.batch_logs([
+            try:
+                h = p.get_dhash()
+            except Exception:
+                groups.append([p])
+                continue
+            keys = [(h >> lo) & ((1 << (hi - lo)) - 1) for lo, hi in band_bits]
+            group = None
+            for bucket, key in zip(buckets, keys):
+                for g in bucket.get(key, []):
+                    if bin(g[0].dhash ^ h).count("1") <= max_distance:
+                        group = g
+                        break
+                if group:
+                    break
+            if group:
+                group.append(p)
+            else:
+                group = [p]
+                groups.append(group)
+                for bucket, key in zip(buckets, keys):
+                    bucket.setdefault(key, []).append(group)
+        if self.parent:
+            self.parent.media_cache.save()
+        return groups
+
+    def collapse_near_duplicates(self, max_distance=4):
+        """New PhotoList keeping only the first photo of each near-duplicate group"""
+        return PhotoList([g[0] for g in self.find_near_duplicates(max_distance)], source=self.source, parent=self.parent)
+
+    def fetch_annotations(self, batch_size=16, max_workers=4, dedup=False, max_distance=4,
+                          inline=False, max_dimension=640, quality=85):
+        """
+        Annotate every photo not annotated yet, with up to max_workers
+        batch_annotate_images calls of batch_size requests in flight.
+        DB logs are written by a background thread off the critical path.
+        With dedup, only one photo of each near-duplicate group is sent and
+        the others share its annotation (photos are downloaded to hash them).
+        inline, max_dimension and quality: see Photo.get_annotation_request;
+        batches are also split to stay under VISION_MAX_REQUEST_BYTES.
+        """
+        if dedup:
+            groups = self.find_near_duplicates(max_distance)
+            PhotoList([g[0] for g in groups], parent=self.parent).fetch_annotations(
+                batch_size, max_workers, inline=inline, max_dimension=max_dimension, quality=quality)
+            annotation_cache = self.parent.annotation_cache
+            for g in groups:
+                labels = annotation_cache.get(g[0].id)
+                if labels is None:
+                    continue
+                for p in g[1:]:
+                    if p.annotation is None and not p.load_cached_annotation():
+                        # cached too, so later runs without dedup don't send it
+                        annotation_cache.put(p.id, labels)
+                        p._apply_labels(labels)
+            annotation_cache.save()
+            return
+
+        # figure out what shoule be requested
+        def _request(p):
+            return p.get_annotation_request(inline=inline, max_dimension=max_dimension, quality=quality)
+        if inline and max_workers > 1 and len(self) > 1:
+            # downscaling is CPU-bound in PIL, which releases the GIL
+            with ThreadPoolExecutor(max_workers=min(max_workers, len(self))) as executor:
+                requests = list(executor.map(_request, self))
+        else:
+            requests = [_request(p) for p in self]
+        pending = [(p, r) for p, r in zip(self, requests) if r]
+        batches = _split_batches(pending, batch_size, VISION_MAX_REQUEST_BYTES)
+        gvision_client = self.parent.gvision_client
+        db_client = self.parent.db_client
+
+        def _annotate(batch):
+            resp = gvision_client.batch_annotate_images([r for p, r in batch])
+            if len(resp.responses) != len(batch):
+                raise Exception("Vision returned {} responses for {} requests".format(len(resp.responses), len(batch)))
+            # responses are in the order of the batch requests
+            annotated = [p for (p, r), response in zip(batch, resp.responses) if p.set_annotation(response)]
+            return [
                 {
                     "type":"annotate",
-                    "keyword": [a.description for a in p.annotation.label_annotations],
+                    "keyword": p.labels,
                     "key":p.remote_url,
-                    "text":p.tweet_json['text'],
+                    "text":p.text,
                     "metadata":{}
-                } for p in completed_photolist
-            ])
-            completed_photolist = None
-            requests = requests[16:]
-
-    def get_annotations(self):
-        self.fetch_annotations()
+                } for p in annotated
+            ]
+
+        try:
+            errors = []
+            with ThreadPoolExecutor(max_workers=1) as log_executor:
+                log_futures = []
+                if max_workers > 1 and len(batches) > 1:
+                    with ThreadPoolExecutor(max_workers=min(max_workers, len(batches))) as executor:
+                        # every batch that made it is logged, even after one failed
+                        for f in as_completed([executor.submit(_annotate, b) for b in batches]):
+                            if f.exception():
+                                errors.append(f.exception())
+                            else:
+                                log_futures.append(log_executor.submit(db_client.batch_logs, f.result()))
+                else:
+                    for b in batches:
+                        log_futures.append(log_executor.submit(db_client.batch_logs, _annotate(b)))
+                for f in log_futures:
+                    f.result()
+            if errors:
+                raise errors[0]
+        finally:
+            self.parent.annotation_cache.save()
+
+    def get_annotations(self, *args, **kwargs):
+        self.fetch_annotations(*args, **kwargs)
         return self.get_list()
 
     def generate_video(self, *args, **kwargs):
@@ -192,18 +609,72 @@ class PhotoList(list):
         return video.generate_annotated_video(self, *args, parent=self, **kwargs)
 
 
+# fonts loaded by load_font, per process
+_fonts = {}
+_fonts_lock = threading.Lock()
+
+
+def load_font(font_path, font_size):
+    """ImageFont.truetype, loaded once per path and size"""
+    key = (font_path, font_size)
+    with _fonts_lock:
+        if key not in _fonts:
+            from PIL import ImageFont
+            _fonts[key] = ImageFont.truetype(font_path, size=font_size)
+        return _fonts[key]
+
+
+def _text_width(font, text):
+    if hasattr(font, "getbbox"):
+        return font.getbbox(text)[2]
+    # Pillow < 8
+    return font.getsize(text)[0]
+
+
+def _line_height(font):
+    ascent, descent = font.getmetrics()
+    return ascent + descent
+
+
+@lru_cache(maxsize=64)
+def text_overlay(message, font, font_size, font_color, width):
+    """
+    RGBA layer of message wrapped to a frame of width, each line centered on
+    its own width; None if there is no text. Cached, as labels repeat across
+    frames.
+    """
+    from PIL import Image, ImageDraw
+    # Draw text: https://stackoverflow.com/a/7698300/4073795
+    lines = textwrap.wrap(message, width=floor((width-4*font_size)/font_size)*2)
+    if not lines:
+        return None
+    line_height = _line_height(font)
+    overlay = Image.new('RGBA', (width, line_height*len(lines)), (0, 0, 0, 0))
+    draw = ImageDraw.Draw(overlay)
+    for i, line in enumerate(lines):
+        draw.text(((width - _text_width(font, line)) / 2, i*line_height), line, fill=font_color, font=font)
+    return overlay
+
+
 class ImOp():
     """Chainable local image operation"""
     im = None
 
     def __init__(self, im):
+        from PIL import Image, ImageFile
         if isinstance(im, Photo):
             im = im.get_im()
         if not isinstance(im, (ImageFile.ImageFile, Image.Image)):
             raise TypeError("ImOp should have a PLI.Image")
         self.im = im
 
-    def resize(self, width=1280, height=720, fill_color=(0, 0, 0)):
+    def resize(self, width=1280, height=720, fill_color=(0, 0, 0), fast=False, canvas=None):
+        """
+        Letterbox into width x height. fast lets JPEGs be decoded at a
+        reduced scale (draft) close to the target size, and resizes with
+        reducing_gap; canvas, an RGB image of the target size, is drawn into
+        instead of allocating a new one.
+        """
         # https://stackoverflow.com/a/44231784/4073795
         x, y = self.im.size
         final_x, final_y = width, height
@@ -215,30 +686,45 @@ class ImOp():
                 final_y = round(y*(width/x))
             else:
                 final_x = round(x*(height/y))
-            resized_im = self.im.resize((final_x, final_y), Image.LANCZOS)
-            self.im = Image.new('RGB', (width, height), fill_color)
+            from PIL import Image
+            if fast:
+                # no-op unless a JPEG not decoded yet
+                self.im.draft('RGB', (final_x, final_y))
+                resized_im = self.im.resize((final_x, final_y), Image.LANCZOS, reducing_gap=3.0)
+            else:
+                resized_im = self.im.resize((final_x, final_y), Image.LANCZOS)
+            if canvas is None:
+                self.im = Image.new('RGB', (width, height), fill_color)
+            else:
+                canvas.paste(fill_color, (0, 0, width, height))
+                self.im = canvas
             self.im.paste(resized_im, (round((width - final_x) / 2), round((height - final_y) / 2)))
             resized_im = None
         return self
 
     def annotate(self, message, font, font_size=40, font_color="rgb(255, 0, 0)"):
+        """
+        Draw message centered near the bottom. The text layer of a message is
+        rendered once (see text_overlay) and composited onto each frame.
+        """
         width, height = self.im.size
-
-        # Draw text: https://stackoverflow.com/a/7698300/4073795
-        draw = ImageDraw.Draw(self.im)
-        lines = textwrap.wrap(message, width=floor((width-4*font_size)/font_size)*2)
-        font_linesize = font.getsize(lines[0])
-        x_text = (width - font_linesize[0]) / 2
-        y_text = max(0, height-font_size*(len(lines)+1))
-        for line in lines:
-            draw.text((x_text, y_text), line, fill=font_color, font=font)
-            y_text += font_linesize[1]
-
+        overlay = text_overlay(message, font, font_size, font_color, width)
+        if overlay is None:
+            return self
+        lines = overlay.height // _line_height(font)
+        y_text = max(0, height-font_size*(lines+1))
+        self.im.paste(overlay, (0, y_text), overlay)
         return self
 
-    def save_as_temp(self, filename=None):
+    def get_frame_bytes(self):
+        """Raw RGB24 pixels, as read by ffmpeg's rawvideo demuxer"""
+        if self.im.mode != "RGB":
+            self.im = self.im.convert("RGB")
+        return self.im.tobytes()
+
+    def save_as_temp(self, filename=None, folder=None):
         if not filename:
             filename = str(uuid.uuid4())+".jpg"
-        name = os.path.join(tempfile.gettempdir(), filename)
+        name = os.path.join(folder or tempfile.gettempdir(), filename)
         self.im.save(name)
         return name
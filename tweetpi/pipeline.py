@@ -0,0 +1,222 @@
+"""
+Staged pipeline: items flow through stages connected by bounded queues, so
+later stages start on an item as soon as earlier stages are done with it.
+"""
+import sys
+import time
+import queue
+import threading
+
+_DONE = object()
+
+
+class _Failed:
+    """Marker passed downstream in place of an item that failed in a stage"""
+
+    def __init__(self, stage, error):
+        self.stage = stage
+        self.error = error
+
+
+class Stage:
+    """
+    func is called with one item (or, when batch_size > 1, with a list of up
+    to batch_size items already queued, returning a list of results) by each
+    of workers threads. An ordered stage (single worker) gets items in input
+    order, e.g. to feed an encoder.
+    """
+
+    def __init__(self, name, func, workers=1, batch_size=1, ordered=False):
+        self.name = name
+        self.func = func
+        self.workers = 1 if ordered else workers
+        self.batch_size = 1 if ordered else batch_size
+        self.ordered = ordered
+
+
+class StageTiming:
+    def __init__(self, name):
+        self.name = name
+        self.items = 0
+        self.busy = 0.0
+        self.first_start = None
+        self.last_end = None
+
+    def add(self, start, end, items):
+        self.items += items
+        self.busy += end - start
+        if self.first_start is None or start < self.first_start:
+            self.first_start = start
+        if self.last_end is None or end > self.last_end:
+            self.last_end = end
+
+    def as_dict(self):
+        return {"items": self.items, "busy": self.busy,
+                "wall": (self.last_end - self.first_start) if self.items else 0.0}
+
+
+class Pipeline:
+    """
+    Run items through stages. Each stage reads from a queue of at most
+    queue_size items, so a slow stage applies backpressure to the ones before
+    it, and at most max_in_flight items (queue_size by default) are between
+    the source and the consumer, including those waiting behind a slow item
+    to come out in order. Results come out in input order; items failing in
+    a stage are dropped and recorded in errors as (stage name, index,
+    exception).
+    """
+
+    def __init__(self, stages, queue_size=16, source_name="source", max_in_flight=None):
+        self.stages = stages
+        self.queue_size = queue_size
+        self.max_in_flight = max_in_flight or queue_size
+        self.source_name = source_name
+        self.timings = {}
+        self.errors = []
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._in_flight = None
+
+    def _acquire(self):
+        while not self._stop.is_set():
+            if self._in_flight.acquire(timeout=0.1):
+                return True
+        return False
+
+    def _put(self, q, value):
+        while not self._stop.is_set():
+            try:
+                q.put(value, timeout=0.1)
+                return
+            except queue.Full:
+                pass
+
+    def _feed(self, items, out_q):
+        timing = self.timings[self.source_name]
+        try:
+            iterator = iter(items)
+            index = 0
+            while self._acquire():
+                start = time.perf_counter()
+                try:
+                    item = next(iterator)
+                except StopIteration:
+                    break
+                except Exception as e:
+                    with self._lock:
+                        self.errors.append((self.source_name, index, e))
+                    break
+                with self._lock:
+                    timing.add(start, time.perf_counter(), 1)
+                self._put(out_q, (index, item))
+                index += 1
+        finally:
+            self._put(out_q, _DONE)
+
+    def _work(self, stage, in_q, out_q, state):
+        timing = self.timings[stage.name]
+        done = False
+        while not done and not self._stop.is_set():
+            try:
+                first = in_q.get(timeout=0.1)
+            except queue.Empty:
+                continue
+            if first is _DONE:
+                break
+            batch = [first]
+            while len(batch) < stage.batch_size:
+                try:
+                    nxt = in_q.get_nowait()
+                except queue.Empty:
+                    break
+                if nxt is _DONE:
+                    done = True
+                    break
+                batch.append(nxt)
+
+            if stage.ordered:
+                state["pending"].update(batch)
+                batch = []
+                while state["next"] in state["pending"]:
+                    batch.append((state["next"], state["pending"].pop(state["next"])))
+                    state["next"] += 1
+
+            results = []
+            for chunk in ([batch] if stage.batch_size > 1 else [[b] for b in batch]):
+                ready = [(i, item) for i, item in chunk if not isinstance(item, _Failed)]
+                results.extend((i, item) for i, item in chunk if isinstance(item, _Failed))
+                if not ready:
+                    continue
+                start = time.perf_counter()
+                try:
+                    if stage.batch_size > 1:
+                        outputs = stage.func([item for i, item in ready])
+                    else:
+                        outputs = [stage.func(ready[0][1])]
+                    results.extend((i, out) for (i, item), out in zip(ready, outputs))
+                except Exception as e:
+                    with self._lock:
+                        for i, item in ready:
+                            self.errors.append((stage.name, i, e))
+                    results.extend((i, _Failed(stage.name, e)) for i, item in ready)
+                with self._lock:
+                    timing.add(start, time.perf_counter(), len(ready))
+            for r in results:
+                self._put(out_q, r)
+
+        # wake up sibling workers; the last one to leave closes the stage
+        self._put(in_q, _DONE)
+        with self._lock:
+            state["running"] -= 1
+            last = state["running"] == 0
+        if last:
+            self._put(out_q, _DONE)
+
+    def run(self, items):
+        """Yield the results of the last stage in input order"""
+        self._stop.clear()
+        self.timings = {self.source_name: StageTiming(self.source_name)}
+        self.errors = []
+        self._in_flight = threading.Semaphore(self.max_in_flight)
+        queues = [queue.Queue(self.queue_size) for _ in range(len(self.stages) + 1)]
+        threads = [threading.Thread(target=self._feed, args=(items, queues[0]), daemon=True)]
+        for n, stage in enumerate(self.stages):
+            self.timings[stage.name] = StageTiming(stage.name)
+            state = {"running": stage.workers, "pending": {}, "next": 0}
+            for _ in range(stage.workers):
+                threads.append(threading.Thread(target=self._work, args=(stage, queues[n], queues[n + 1], state), daemon=True))
+        for t in threads:
+            t.start()
+
+        pending = {}
+        next_index = 0
+        out_q = queues[-1]
+        try:
+            while True:
+                value = out_q.get()
+                if value is _DONE:
+                    break
+                pending[value[0]] = value[1]
+                # failed items still arrive, as _Failed, so there are no holes
+                while next_index in pending:
+                    result = pending.pop(next_index)
+                    next_index += 1
+                    self._in_flight.release()
+                    if not isinstance(result, _Failed):
+                        yield result
+        finally:
+            self._stop.set()
+            for t in threads:
+                t.join()
+
+    def get_timings(self):
+        """{stage name: {"items", "busy", "wall"}}, busy and wall in seconds"""
+        with self._lock:
+            return {name: t.as_dict() for name, t in self.timings.items()}
+
+    def print_timings(self, file=sys.stderr):
+        table = "{:>16} {:>8} {:>10} {:>10}"
+        print(table.format("Stage", "Items", "Busy (s)", "Wall (s)"), file=file)
+        print(table.format("-"*16, "-"*8, "-"*10, "-"*10), file=file)
+        for name, t in self.get_timings().items():
+            print(table.format(name, t["items"], "{:.2f}".format(t["busy"]), "{:.2f}".format(t["wall"])), file=file)
@@ -0,0 +1,120 @@
+"""
+Rate-limit aware scheduling of Twitter API calls, with a short-lived response cache.
+"""
+import time
+import threading
+
+
+class TwitterScheduler:
+    """
+    Call tweepy.API methods through one scheduler per token. The remaining
+    calls and reset time reported by Twitter are tracked per endpoint; when a
+    window is used up, calls wait for the reset instead of failing with 429.
+    Responses are cached for ttl seconds, keyed by endpoint and arguments, so
+    identical calls from different jobs in the same process share one request.
+    """
+    ttl = 60
+    max_retries = 3
+    default_window = 15 * 60
+
+    def __init__(self, api, ttl=None, sleep=time.sleep, clock=time.time):
+        self.api = api
+        if ttl is not None:
+            self.ttl = ttl
+        self.sleep = sleep
+        self.clock = clock
+        self._lock = threading.Lock()
+        self._endpoint_locks = {}
+        self._limits = {}
+        self._cache = {}
+
+    def _endpoint_lock(self, endpoint):
+        with self._lock:
+            if endpoint not in self._endpoint_locks:
+                self._endpoint_locks[endpoint] = threading.Lock()
+            return self._endpoint_locks[endpoint]
+
+    def _get_cached(self, key):
+        with self._lock:
+            if key in self._cache:
+                expires, result = self._cache[key]
+                if expires > self.clock():
+                    return True, result
+                del self._cache[key]
+        return False, None
+
+    def _update_limits(self, endpoint, headers):
+        remaining = headers.get("x-rate-limit-remaining") if headers else None
+        reset = headers.get("x-rate-limit-reset") if headers else None
+        with self._lock:
+            limit = self._limits.setdefault(endpoint, {"remaining": None, "reset": 0})
+            if remaining is not None and reset is not None:
+                limit["remaining"] = int(remaining)
+                limit["reset"] = int(reset)
+            elif limit["remaining"]:
+                limit["remaining"] -= 1
+
+    def _wait(self, endpoint):
+        with self._lock:
+            limit = self._limits.get(endpoint)
+            delay = 0
+            if limit and limit["remaining"] == 0:
+                delay = limit["reset"] - self.clock() + 1
+        if delay > 0:
+            self.sleep(delay)
+
+    def get_limits(self, endpoint):
+        """Last known {"remaining", "reset"} of endpoint, or None"""
+        with self._lock:
+            limit = self._limits.get(endpoint)
+            return dict(limit) if limit else None
+
+    def call(self, endpoint, **kwargs):
+        key = (endpoint, tuple(sorted(kwargs.items())))
+        hit, result = self._get_cached(key)
+        if hit:
+            return list(result)
+
+        # calls to one endpoint are queued, which also keeps last_response
+        # headers paired with the call that produced them
+        with self._endpoint_lock(endpoint):
+            hit, result = self._get_cached(key)
+            if hit:
+                return list(result)
+            for attempt in range(self.max_retries + 1):
+                self._wait(endpoint)
+                try:
+                    result = getattr(self.api, endpoint)(**kwargs)
+                except Exception as e:
+                    response = getattr(e, "response", None)
+                    status = getattr(response, "status_code", None) or getattr(response, "status", None)
+                    if status != 429 or attempt == self.max_retries:
+                        raise
+                    headers = dict(getattr(response, "headers", None) or {})
+                    headers["x-rate-limit-remaining"] = 0
+                    headers.setdefault("x-rate-limit-reset", self.clock() + self.default_window)
+                    self._update_limits(endpoint, headers)
+                    continue
+                last_response = getattr(self.api, "last_response", None)
+                self._update_limits(endpoint, getattr(last_response, "headers", None))
+                break
+
+            with self._lock:
+                self._cache[key] = (self.clock() + self.ttl, list(result))
+        return list(result)
+
+    def clear_cache(self):
+        with self._lock:
+            self._cache.clear()
+
+
+_schedulers = {}
+_schedulers_lock = threading.Lock()
+
+
+def get_scheduler(token, api, ttl=None):
+    """Scheduler shared by every TweetPI in this process using the same token"""
+    with _schedulers_lock:
+        if token not in _schedulers:
+            _schedulers[token] = TwitterScheduler(api, ttl=ttl)
+        return _schedulers[token]
@@ -0,0 +1,257 @@
+"""
+Record real Twitter timelines, media bytes and Vision labels to a fixture
+folder, and replay them without network or credentials, e.g.
+
+    tpi = TweetPI(options, **replay.recording_factories("fixtures"))
+    tpi = TweetPI(options, **replay.replay_factories("fixtures", latency=0.05))
+"""
+import os
+import json
+import time
+import hashlib
+from contextlib import contextmanager
+
+from tweetpi import network
+from tweetpi.cache import atomic_write_json
+
+
+def _key(*parts):
+    return hashlib.sha1(json.dumps(parts, sort_keys=True, default=str).encode("utf-8")).hexdigest()
+
+
+def _vision_key(request):
+    image = request['image']
+    if image.get('content'):
+        return _key("content", hashlib.sha1(image['content']).hexdigest())
+    return _key("uri", image['source']['image_uri'])
+
+
+class FixtureStore:
+    """JSON and binary fixtures under folder/<kind>/<key>"""
+
+    def __init__(self, folder):
+        self.folder = folder
+
+    def _path(self, kind, key, ext):
+        return os.path.join(self.folder, kind, key + ext)
+
+    def save_json(self, kind, key, data):
+        os.makedirs(os.path.join(self.folder, kind), exist_ok=True)
+        atomic_write_json(self._path(kind, key, ".json"), data)
+
+    def load_json(self, kind, key):
+        path = self._path(kind, key, ".json")
+        if not os.path.isfile(path):
+            raise KeyError("No {} fixture {} in {}".format(kind, key, self.folder))
+        with open(path, "r") as fp:
+            return json.load(fp)
+
+    def save_bytes(self, kind, key, data):
+        os.makedirs(os.path.join(self.folder, kind), exist_ok=True)
+        with open(self._path(kind, key, ".bin"), "wb") as fp:
+            fp.write(data)
+
+    def load_bytes(self, kind, key):
+        path = self._path(kind, key, ".bin")
+        if not os.path.isfile(path):
+            return None
+        with open(path, "rb") as fp:
+            return fp.read()
+
+
+# Twitter
+
+class ReplayStatus:
+    """Stand-in for tweepy's Status: attributes from the tweet JSON"""
+
+    def __init__(self, tweet_json):
+        self._json = tweet_json
+        self.__dict__.update(tweet_json)
+
+
+class RecordingTwitterAPI:
+    """Wrap a tweepy.API, saving timeline responses as fixtures"""
+    endpoints = ("home_timeline", "user_timeline")
+
+    def __init__(self, api, store):
+        self.api = api
+        self.store = store
+
+    @property
+    def last_response(self):
+        return getattr(self.api, "last_response", None)
+
+    def _call(self, endpoint, **kwargs):
+        result = getattr(self.api, endpoint)(**kwargs)
+        self.store.save_json("twitter", _key(endpoint, kwargs), [t._json for t in result])
+        return result
+
+    def home_timeline(self, **kwargs):
+        return self._call("home_timeline", **kwargs)
+
+    def user_timeline(self, **kwargs):
+        return self._call("user_timeline", **kwargs)
+
+
+class ReplayTwitterAPI:
+    """Serve recorded timeline responses, after latency seconds"""
+
+    def __init__(self, store, latency=0):
+        self.store = store
+        self.latency = latency
+
+    def _call(self, endpoint, **kwargs):
+        if self.latency:
+            time.sleep(self.latency)
+        return [ReplayStatus(t) for t in self.store.load_json("twitter", _key(endpoint, kwargs))]
+
+    def home_timeline(self, **kwargs):
+        return self._call("home_timeline", **kwargs)
+
+    def user_timeline(self, **kwargs):
+        return self._call("user_timeline", **kwargs)
+
+
+# Google Vision
+
+class ReplayLabel:
+    def __init__(self, description, score):
+        self.description = description
+        self.score = score
+
+
+class ReplayAnnotateImageResponse:
+    def __init__(self, labels):
+        self.label_annotations = [ReplayLabel(d, s) for d, s in labels]
+
+
+class ReplayBatchAnnotateImagesResponse:
+    def __init__(self, responses):
+        self.responses = responses
+
+
+class RecordingVisionClient:
+    """Wrap an ImageAnnotatorClient, saving the labels of each response"""
+
+    def __init__(self, client, store):
+        self.client = client
+        self.store = store
+
+    def _save(self, request, response):
+        self.store.save_json("vision", _vision_key(request),
+                             [[a.description, a.score] for a in response.label_annotations])
+
+    def annotate_image(self, request):
+        response = self.client.annotate_image(request)
+        self._save(request, response)
+        return response
+
+    def batch_annotate_images(self, requests):
+        resp = self.client.batch_annotate_images(requests)
+        for request, response in zip(requests, resp.responses):
+            self._save(request, response)
+        return resp
+
+
+class ReplayVisionClient:
+    """Serve recorded labels, after latency seconds per call"""
+
+    def __init__(self, store, latency=0):
+        self.store = store
+        self.latency = latency
+
+    def _load(self, request):
+        return ReplayAnnotateImageResponse(self.store.load_json("vision", _vision_key(request)))
+
+    def annotate_image(self, request):
+        if self.latency:
+            time.sleep(self.latency)
+        return self._load(request)
+
+    def batch_annotate_images(self, requests):
+        if self.latency:
+            time.sleep(self.latency)
+        return ReplayBatchAnnotateImagesResponse([self._load(r) for r in requests])
+
+
+# Media
+
+class ReplayResponse:
+    """Just enough of http.client.HTTPResponse for Photo.download"""
+    will_close = False
+
+    def __init__(self, status, body=b"", headers=None):
+        self.status = status
+        self.headers = dict(headers or {})
+        self.headers["Content-Length"] = str(len(body))
+        self._body = body
+        self._pos = 0
+
+    def getheader(self, name, default=None):
+        return self.headers.get(name, default)
+
+    def read(self, amt=None):
+        end = len(self._body) if amt is None else self._pos + amt
+        data = self._body[self._pos:end]
+        self._pos += len(data)
+        return data
+
+    def isclosed(self):
+        return self._pos >= len(self._body)
+
+
+class RecordingConnectionPool(network.ConnectionPool):
+    """ConnectionPool saving every 200 response body as a fixture"""
+
+    def __init__(self, store, timeout=None):
+        super().__init__(timeout=timeout)
+        self.store = store
+
+    @contextmanager
+    def open(self, url, headers=None):
+        # always fetch the full body, so that the fixture is complete
+        with super().open(url) as response:
+            body = response.read()
+            status = response.status
+            if status == 200:
+                self.store.save_bytes("media", _key(url), body)
+        yield ReplayResponse(status, body)
+
+
+class ReplayConnectionPool:
+    """Serve recorded media bodies (404 if missing), after latency seconds"""
+
+    def __init__(self, store, latency=0):
+        self.store = store
+        self.latency = latency
+
+    @contextmanager
+    def open(self, url, headers=None):
+        if self.latency:
+            time.sleep(self.latency)
+        body = self.store.load_bytes("media", _key(url))
+        yield ReplayResponse(200, body) if body is not None else ReplayResponse(404)
+
+    def close(self):
+        pass
+
+
+def recording_factories(folder):
+    """TweetPI keyword arguments recording real API traffic into folder"""
+    from tweetpi.tweetpi import create_twitter_api, create_gvision_client
+    store = FixtureStore(folder)
+    return {
+        "twitter_api_factory": lambda tpi: RecordingTwitterAPI(create_twitter_api(tpi), store),
+        "gvision_client_factory": lambda tpi: RecordingVisionClient(create_gvision_client(tpi), store),
+        "http_pool_factory": lambda tpi: RecordingConnectionPool(store),
+    }
+
+
+def replay_factories(folder, latency=0):
+    """TweetPI keyword arguments serving API traffic recorded in folder"""
+    store = FixtureStore(folder)
+    return {
+        "twitter_api_factory": lambda tpi: ReplayTwitterAPI(store, latency),
+        "gvision_client_factory": lambda tpi: ReplayVisionClient(store, latency),
+        "http_pool_factory": lambda tpi: ReplayConnectionPool(store, latency),
+    }
@@ -1,7 +1,7 @@
 import json
 import sys
 import os
-from tweetpi import TweetPI, video, __version__ as tweetpi_version
+from tweetpi import TweetPI, video, replay, batch, __version__ as tweetpi_version
 
 def shell_print_exception(error_name=None):
     import traceback
@@ -28,14 +28,19 @@ def shell_init_lib(args):
     except Exception:
         shell_print_exception('Options load failure')
         sys.exit(1)
-    tpi = TweetPI(o)
+    factories = {}
+    if 'record' in args and args.record:
+        factories = replay.recording_factories(args.record)
+    elif 'replay' in args and args.replay:
+        factories = replay.replay_factories(args.replay, latency=args.replay_latency)
+    tpi = TweetPI(o, **factories)
     return tpi
 
 def shell_list(args):
     tpi = shell_init_lib(args)
     try:
         if 'timeline' in args:
-            photolist = tpi.get_timeline(username=args.timeline, page=1, limit=args.limit)
+            photolist = tpi.get_timeline(username=args.timeline, page=1, limit=args.limit, incremental=args.incremental, merge=args.merge)
         else:
             sys.exit(1)
     except Exception:
@@ -49,8 +54,8 @@ def shell_download(args):
     tpi = shell_init_lib(args)
     try:
         if 'timeline' in args:
-            photolist = tpi.get_timeline(username=args.timeline, page=1, limit=args.limit)
-            photolist.download_all(shell=True)
+            photolist = tpi.get_timeline(username=args.timeline, page=1, limit=args.limit, incremental=args.incremental, merge=args.merge)
+            photolist.download_all(shell=True, max_workers=args.max_workers)
         else:
             sys.exit(1)
     except Exception:
@@ -67,8 +72,16 @@ def shell_video(args):
                 print("Size should be like 1280x720", file=sys.stderr)
                 sys.exit(1)
             photolist = tpi.get_timeline(username=args.timeline, page=1, limit=args.limit)
-            result = video.generate_video(photos=photolist, name=args.output, size=size, shell=True, interval=args.interval, parent=tpi)
+            timings = {}
+            result = video.generate_video(photos=photolist, name=args.output, size=size, shell=True, interval=args.interval, parent=tpi,
+                                          collapse_duplicates=args.collapse_duplicates, pipeline=args.pipeline, stream=args.stream, workers=args.workers,
+                                          cache_frames=args.frame_cache, segments=args.segments,
+                                          slideshow=args.slideshow, preset=args.preset, crf=args.crf, threads=args.threads,
+                                          timings=timings)
             print(result)
+            if timings.get("errors"):
+                # photos were left out of the video
+                sys.exit(2)
         else:
             sys.exit(1)
     except Exception:
@@ -79,8 +92,8 @@ def shell_annotate(args):
     tpi = shell_init_lib(args)
     try:
         if 'timeline' in args:
-            photolist = tpi.get_timeline(username=args.timeline, page=1, limit=args.limit)
-            result = photolist.get_annotations()
+            photolist = tpi.get_timeline(username=args.timeline, page=1, limit=args.limit, incremental=args.incremental, merge=args.merge)
+            result = photolist.get_annotations(max_workers=args.max_workers, inline=args.inline)
         else:
             sys.exit(1)
     except Exception:
@@ -88,7 +101,8 @@ def shell_annotate(args):
         sys.exit(2)
 
     for t in result:
-        print('{}: {}'.format(t.remote_url, ", ".join([a.description for a in t.annotation.label_annotations])))
+        print('{}: {}'.format(t.remote_url, ", ".join(t.labels)))
+    print("Annotation cache: {} hits, {} misses".format(tpi.annotation_cache.hits, tpi.annotation_cache.misses), file=sys.stderr)
 
 def shell_annotatedvideo(args):
     tpi = shell_init_lib(args)
@@ -100,15 +114,46 @@ def shell_annotatedvideo(args):
                 print("Size should be like 1280x720", file=sys.stderr)
                 sys.exit(1)
             photolist = tpi.get_timeline(username=args.timeline, page=1, limit=args.limit)
+            timings = {}
             result = video.generate_annotated_video(photos=photolist, name=args.output, size=size, shell=True,
-                                                    font_color=args.fontcolor, font_file=args.fontfile, interval=args.interval, font_size=args.fontsize, parent=tpi)
+                                                    font_color=args.fontcolor, font_file=args.fontfile, interval=args.interval, font_size=args.fontsize, parent=tpi,
+                                                    collapse_duplicates=args.collapse_duplicates, dedup=args.dedup, pipeline=args.pipeline, stream=args.stream, workers=args.workers,
+                                                    cache_frames=args.frame_cache, segments=args.segments,
+                                                    slideshow=args.slideshow, preset=args.preset, crf=args.crf, threads=args.threads,
+                                                    timings=timings)
             print(result)
+            if timings.get("errors"):
+                # photos were left out of the video
+                sys.exit(2)
         else:
             sys.exit(1)
     except Exception:
         shell_print_exception()
         sys.exit(2)
 
+def shell_batch(args):
+    tpi = shell_init_lib(args)
+    try:
+        jobs = [batch.VideoJob(timeline, annotated=args.annotated, limit=args.limit) for timeline in args.TIMELINE]
+        if args.jobs:
+            jobs.extend(batch.load_jobs(args.jobs))
+        if not jobs:
+            print("No timelines or job file given", file=sys.stderr)
+            sys.exit(1)
+        results = batch.run_batch(tpi, jobs, max_jobs=args.max_jobs, max_ffmpeg=args.max_ffmpeg, shell=True)
+    except Exception:
+        shell_print_exception()
+        sys.exit(2)
+
+    table = "{:>24} {:>6} {:>8}  {}"
+    print(table.format("Timeline", "Status", "Time (s)", "Video / Error"))
+    print(table.format("-"*24, "-"*6, "-"*8, "-"*24))
+    for r in results:
+        print(table.format(r.job.timeline, "ok" if r.ok else "failed", "{:.1f}".format(r.seconds),
+                           r.path if r.ok else (r.error or "no video generated")))
+    if not all(r.ok for r in results):
+        sys.exit(2)
+
 
 def shell_get_total_by_type(args):
     tpi = shell_init_lib(args)
@@ -192,18 +237,26 @@ def main(argv=None):
 
     argparser = argparse.ArgumentParser(prog="TweetPI.py", description='Tweet Photo Insight: Python library to get photos in Twitter feed, with a video and photo annotations.')
     argparser.add_argument('--version', action='version', version='%(prog)s {}'.format(tweetpi_version))
+    argparser.add_argument('--record', help="save Twitter, media and Vision responses as fixtures in this folder")
+    argparser.add_argument('--replay', help="serve Twitter, media and Vision responses from fixtures in this folder")
+    argparser.add_argument('--replay-latency', help="seconds added to each replayed call, default: 0", type=float, default=0)
     subparsers = argparser.add_subparsers(help=".")
 
     parser_list = subparsers.add_parser('list', help='list images in Twitter feed')
     parser_list.add_argument('--timeline', '-tl', required=True, const="__home__", nargs="?", help="from your home timeline or someone's user timeline")
     parser_list.add_argument('--limit', help="tweets limit")
     parser_list.add_argument('--options', help="Init config for TweetPI library (JSON file path or JSON string)")
+    parser_list.add_argument('--incremental', help="only fetch tweets newer than the last incremental run", action="store_true")
+    parser_list.add_argument('--merge', help="with --incremental, also include photos known from earlier runs", action="store_true")
     parser_list.set_defaults(func=shell_list)
 
     parser_download = subparsers.add_parser('download', help='download images in Twitter feed')
     parser_download.add_argument('--timeline', '-tl', required=True, const="__home__", nargs="?", help="from your home timeline or someone's user timeline")
     parser_download.add_argument('--limit', help="tweets limit")
     parser_download.add_argument('--options', help="Init config for TweetPI library (JSON file path or JSON string)")
+    parser_download.add_argument('--incremental', help="only fetch tweets newer than the last incremental run", action="store_true")
+    parser_download.add_argument('--merge', help="with --incremental, also include photos known from earlier runs", action="store_true")
+    parser_download.add_argument('--max-workers', help="Concurrent downloads, default: 4", type=int, default=4)
     parser_download.set_defaults(func=shell_download)
 
     parser_video = subparsers.add_parser('video', help='generate a video from images in Twitter feed')
@@ -213,12 +266,26 @@ def main(argv=None):
     parser_video.add_argument('--size', help="Video size, default: 1280x720")
     parser_video.add_argument('--output', help="Output filename, default: timeline-id.mp4")
     parser_video.add_argument('--interval', help="Seconds per image, default: 3", type=int, default=3)
+    parser_video.add_argument('--collapse-duplicates', help="show only the first of near-duplicate (reposted) photos", action="store_true")
+    parser_video.add_argument('--pipeline', help="overlap download, annotate, render and encode; prints per-stage timings", action="store_true")
+    parser_video.add_argument('--stream', help="pipe frames into ffmpeg instead of writing temp files", action="store_true")
+    parser_video.add_argument('--workers', help="processes rendering frames, default: 1", type=int, default=1)
+    parser_video.add_argument('--frame-cache', help="keep rendered frames, and reuse those of earlier runs", action="store_true")
+    parser_video.add_argument('--segments', help="reuse an encoded clip per photo and join them without re-encoding", action="store_true")
+    parser_video.add_argument('--slideshow', help="encode one frame per photo instead of 25 fps", action="store_true")
+    parser_video.add_argument('--preset', help="x264 preset, e.g. veryfast, default: ffmpeg's")
+    parser_video.add_argument('--crf', help="x264 constant rate factor, default: ffmpeg's", type=int)
+    parser_video.add_argument('--threads', help="ffmpeg encoding threads, default: ffmpeg's", type=int)
     parser_video.set_defaults(func=shell_video)
 
     parser_annotate = subparsers.add_parser('annotate', help='get annotations of images in Twitter feed')
     parser_annotate.add_argument('--timeline', '-tl', required=True, const="__home__", nargs="?", help="from your home timeline or someone's user timeline")
     parser_annotate.add_argument('--limit', help="tweets limit")
     parser_annotate.add_argument('--options', help="Init config for TweetPI library (JSON file path or JSON string)")
+    parser_annotate.add_argument('--max-workers', help="Concurrent Vision batch requests, default: 4", type=int, default=4)
+    parser_annotate.add_argument('--inline', help="download images and send downscaled copies to Vision", action="store_true")
+    parser_annotate.add_argument('--incremental', help="only fetch tweets newer than the last incremental run", action="store_true")
+    parser_annotate.add_argument('--merge', help="with --incremental, also include photos known from earlier runs", action="store_true")
     parser_annotate.set_defaults(func=shell_annotate)
 
     parser_annotatedvideo = subparsers.add_parser('annotatedvideo', help='get annotated video of photos in Twitter feed')
@@ -228,11 +295,32 @@ def main(argv=None):
     parser_annotatedvideo.add_argument('--size', help="Video size, default: 1280x720")
     parser_annotatedvideo.add_argument('--output', help="Output filename, default: timeline-id.mp4")
     parser_annotatedvideo.add_argument('--interval', help="Seconds per image, default: 3", type=int, default=3)
+    parser_annotatedvideo.add_argument('--collapse-duplicates', help="show only the first of near-duplicate (reposted) photos", action="store_true")
+    parser_annotatedvideo.add_argument('--pipeline', help="overlap download, annotate, render and encode; prints per-stage timings", action="store_true")
+    parser_annotatedvideo.add_argument('--stream', help="pipe frames into ffmpeg instead of writing temp files", action="store_true")
+    parser_annotatedvideo.add_argument('--workers', help="processes rendering frames, default: 1", type=int, default=1)
+    parser_annotatedvideo.add_argument('--frame-cache', help="keep rendered frames, and reuse those of earlier runs", action="store_true")
+    parser_annotatedvideo.add_argument('--segments', help="reuse an encoded clip per photo and join them without re-encoding", action="store_true")
+    parser_annotatedvideo.add_argument('--slideshow', help="encode one frame per photo instead of 25 fps", action="store_true")
+    parser_annotatedvideo.add_argument('--preset', help="x264 preset, e.g. veryfast, default: ffmpeg's")
+    parser_annotatedvideo.add_argument('--crf', help="x264 constant rate factor, default: ffmpeg's", type=int)
+    parser_annotatedvideo.add_argument('--threads', help="ffmpeg encoding threads, default: ffmpeg's", type=int)
+    parser_annotatedvideo.add_argument('--dedup', help="near-duplicate photos share one annotation request", action="store_true")
     parser_annotatedvideo.add_argument('--fontfile', help="Optional font file path (should be ttf file)", default="Roboto-Regular.ttf")
     parser_annotatedvideo.add_argument('--fontcolor', help="Optional font color, default: rgb(255, 0, 0)", default="rgb(255, 0, 0)")
     parser_annotatedvideo.add_argument('--fontsize', help="Optional font size, default: 40", type=int, default=40)
     parser_annotatedvideo.set_defaults(func=shell_annotatedvideo)
 
+    parser_batch = subparsers.add_parser('batch', help='generate the videos of many timelines in one run')
+    parser_batch.add_argument('TIMELINE', nargs="*", help="timelines to make videos of (__home__ for your home timeline)")
+    parser_batch.add_argument('--jobs', help="JSON file of jobs: timeline names, or objects like {\"timeline\": \"POTUS\", \"annotated\": true, \"output\": \"potus.mp4\", \"size\": \"640x360\"}")
+    parser_batch.add_argument('--options', help="Init config for TweetPI library (JSON file path or JSON string)")
+    parser_batch.add_argument('--limit', help="tweets limit of TIMELINE jobs")
+    parser_batch.add_argument('--annotated', help="annotated videos for TIMELINE jobs", action="store_true")
+    parser_batch.add_argument('--max-jobs', help="videos generated at a time, default: 4", type=int, default=4)
+    parser_batch.add_argument('--max-ffmpeg', help="ffmpeg processes at a time, default: 2", type=int, default=2)
+    parser_batch.set_defaults(func=shell_batch)
+
     parser_get_annotation_keywords_list = subparsers.add_parser('get_annotation_keywords_list', help='get annotation keywords list in db')
     parser_get_annotation_keywords_list.add_argument('--options', help="Init config for TweetPI library (JSON file path or JSON string)")
     parser_get_annotation_keywords_list.add_argument('--limit', help="results limit", type=int, default=20)
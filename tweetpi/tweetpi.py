@@ -1,9 +1,44 @@
-import tweepy
-
-from tweetpi import Photo, PhotoList, database
+from tweetpi import Photo, PhotoList, database, network, cache, ratelimit
 import os
+import threading
+
+
+def create_twitter_api(tpi):
+    import tweepy
+    tauth = tweepy.OAuthHandler(tpi.twitter_consumer_key, tpi.twitter_consumer_secret)
+    tauth.set_access_token(tpi.twitter_access_token, tpi.twitter_access_secret)
+    return tweepy.API(tauth)
+
+
+def create_gvision_client(tpi):
+    from google.oauth2 import service_account
+    credentials = service_account.Credentials.from_service_account_file(os.path.join(tpi.conf_folder or "", tpi.google_key_json))
+    # scoped_credentials = credentials.with_scopes(['https://www.googleapis.com/auth/cloud-platform'])
+    from google.cloud import vision
+    return vision.ImageAnnotatorClient(credentials=credentials)
+
+
+def create_db_client(tpi):
+    if tpi.db_enable:
+        client = database.init(tpi.db_uri)
+        if tpi.db_buffered:
+            client = database.BufferedDBClient(client)
+        return client
+    else:
+        return database.NoDBClient(debug=False)
+
+
+def create_http_pool(tpi):
+    return network.ConnectionPool()
+
 
 class TweetPI:
+    """
+    Twitter, Google Vision and database clients are created on first use,
+    so that e.g. DB-only commands don't pay for initializing gRPC.
+    Each client comes from a factory called with the TweetPI instance; pass
+    your own (see tweetpi.replay) to record or replay API traffic.
+    """
     twitter_consumer_key = None
     twitter_consumer_secret = None
     twitter_access_token = None
@@ -11,15 +46,30 @@ class TweetPI:
     google_key_json = None
     local_folder = None
     conf_folder = None
-    twitter_api = None
-    gvision_client = None
+    twitter_cache_ttl = 60
     db_enable = False
     db_uri = ""
-    db_client = None
+    db_buffered = False
+    http_pool = None
+    media_cache_size = 1024 * 1024 * 1024
+    frame_cache_size = 1024 * 1024 * 1024
+    segment_cache_size = 1024 * 1024 * 1024
+    keep_tweet_json = False
+    annotation_min_score = 0
+    _twitter_api = None
+    _twitter_scheduler = None
+    _gvision_client = None
+    _db_client = None
+    _media_cache = None
+    _frame_cache = None
+    _segment_cache = None
+    _timeline_cursors = None
+    _annotation_cache = None
 
 
-    def __init__(self, options):
-        keys = ["twitter_consumer_key", "twitter_consumer_secret", "twitter_access_token", "twitter_access_secret", "google_key_json", "_local_folder", "_conf_folder", "_db_enable", "_db_uri"]
+    def __init__(self, options, twitter_api_factory=None, gvision_client_factory=None,
+                 db_client_factory=None, http_pool_factory=None):
+        keys = ["twitter_consumer_key", "twitter_consumer_secret", "twitter_access_token", "twitter_access_secret", "google_key_json", "_local_folder", "_conf_folder", "_db_enable", "_db_uri", "_db_buffered", "_media_cache_size", "_frame_cache_size", "_segment_cache_size", "_twitter_cache_ttl", "_keep_tweet_json", "_annotation_min_score"]
         if type(options) == dict:
             for k in keys:
                 optional = k.startswith("_")
@@ -29,42 +79,214 @@ class TweetPI:
                 elif not optional:
                     raise Exception("{} not provided in the options".format(key))
 
-        # Init Twitter API
-        tauth = tweepy.OAuthHandler(self.twitter_consumer_key, self.twitter_consumer_secret)
-        tauth.set_access_token(self.twitter_access_token, self.twitter_access_secret)
-        self.twitter_api = tweepy.API(tauth)
-
-        # Init Google Vision API
-        from google.oauth2 import service_account
-        credentials = service_account.Credentials.from_service_account_file(os.path.join(self.conf_folder, self.google_key_json))
-        # scoped_credentials = credentials.with_scopes(['https://www.googleapis.com/auth/cloud-platform'])
-        from google.cloud import vision
-        self.gvision_client = vision.ImageAnnotatorClient(credentials=credentials)
-
-        # Init Database
-        if self.db_enable:
-            self.db_client = database.init(self.db_uri)
-        else:
-            self.db_client = database.NoDBClient(debug=False)
+        self._client_lock = threading.RLock()
+        self.twitter_api_factory = twitter_api_factory or create_twitter_api
+        self.gvision_client_factory = gvision_client_factory or create_gvision_client
+        self.db_client_factory = db_client_factory or create_db_client
+
+        # Init media HTTP connection pool
+        self.http_pool = (http_pool_factory or create_http_pool)(self)
+
+    @property
+    def twitter_api(self):
+        with self._client_lock:
+            if self._twitter_api is None:
+                self._twitter_api = self.twitter_api_factory(self)
+            return self._twitter_api
+
+    @twitter_api.setter
+    def twitter_api(self, value):
+        self._twitter_api = value
+
+    @property
+    def twitter_scheduler(self):
+        with self._client_lock:
+            if self._twitter_scheduler is None:
+                if self.twitter_api_factory is create_twitter_api:
+                    self._twitter_scheduler = ratelimit.get_scheduler(self.twitter_access_token, self.twitter_api, ttl=self.twitter_cache_ttl)
+                else:
+                    self._twitter_scheduler = ratelimit.TwitterScheduler(self.twitter_api, ttl=self.twitter_cache_ttl)
+            return self._twitter_scheduler
+
+    @twitter_scheduler.setter
+    def twitter_scheduler(self, value):
+        self._twitter_scheduler = value
+
+    @property
+    def gvision_client(self):
+        with self._client_lock:
+            if self._gvision_client is None:
+                self._gvision_client = self.gvision_client_factory(self)
+            return self._gvision_client
+
+    @gvision_client.setter
+    def gvision_client(self, value):
+        self._gvision_client = value
 
-    def get_timeline(self, username, page, limit, order_latest=False):
-        self.db_client.log(type="get_timeline", keyword=username, key=username, text="", metadata={"page":page, "limit":limit})
+    @property
+    def db_client(self):
+        with self._client_lock:
+            if self._db_client is None:
+                self._db_client = self.db_client_factory(self)
+            return self._db_client
+
+    @db_client.setter
+    def db_client(self, value):
+        self._db_client = value
+
+    @property
+    def media_cache(self):
+        with self._client_lock:
+            if self._media_cache is None:
+                self._media_cache = cache.MediaCache(os.path.join(self.local_folder or "", "media_cache"),
+                                                     max_bytes=self.media_cache_size)
+            return self._media_cache
+
+    @media_cache.setter
+    def media_cache(self, value):
+        self._media_cache = value
+
+    @property
+    def frame_cache(self):
+        """Rendered video frames, reused while a photo renders the same"""
+        with self._client_lock:
+            if self._frame_cache is None:
+                self._frame_cache = cache.FrameCache(os.path.join(self.local_folder or "", "frame_cache"),
+                                                     max_bytes=self.frame_cache_size)
+            return self._frame_cache
+
+    @frame_cache.setter
+    def frame_cache(self, value):
+        self._frame_cache = value
+
+    @property
+    def segment_cache(self):
+        """Encoded one-photo video clips, joined into videos with stream copy"""
+        with self._client_lock:
+            if self._segment_cache is None:
+                self._segment_cache = cache.FileCache(os.path.join(self.local_folder or "", "segment_cache"),
+                                                      max_bytes=self.segment_cache_size)
+            return self._segment_cache
+
+    @segment_cache.setter
+    def segment_cache(self, value):
+        self._segment_cache = value
+
+    @property
+    def timeline_cursors(self):
+        """since_id cursors for incremental timelines"""
+        with self._client_lock:
+            if self._timeline_cursors is None:
+                self._timeline_cursors = cache.TimelineCursors(os.path.join(self.conf_folder or "", "timeline_cursors.json"))
+            return self._timeline_cursors
+
+    @timeline_cursors.setter
+    def timeline_cursors(self, value):
+        self._timeline_cursors = value
+
+    @property
+    def annotation_cache(self):
+        """Vision labels of photos annotated before"""
+        with self._client_lock:
+            if self._annotation_cache is None:
+                self._annotation_cache = cache.AnnotationCache(os.path.join(self.local_folder or "", "annotation_cache.jsonl"))
+                legacy_path = os.path.join(self.local_folder or "", "annotation_cache.json")
+                if os.path.isfile(legacy_path):
+                    self._annotation_cache.import_json(legacy_path)
+            return self._annotation_cache
+
+    @annotation_cache.setter
+    def annotation_cache(self, value):
+        self._annotation_cache = value
+
+    def _fetch_timeline(self, username, **kwargs):
         if username == "__home__":
-            tweets = self.twitter_api.home_timeline(
-                count=limit, page=page, trim_user=True, tweet_mode="extended")
+            return self.twitter_scheduler.call("home_timeline", trim_user=True, tweet_mode="extended", **kwargs)
         else:
-            tweets = self.twitter_api.user_timeline(
-                id=username, count=limit, page=page, trim_user=True, tweet_mode="extended")
+            return self.twitter_scheduler.call("user_timeline", id=username, trim_user=True, tweet_mode="extended", **kwargs)
+
+    def _iter_timeline_pages(self, username, count, since_id=None):
+        """
+        Pages of tweets, latest first, walked back with max_id so they never
+        overlap, until the timeline (or since_id) is reached
+        """
+        max_id = None
+        while True:
+            kwargs = {"count": count}
+            if since_id:
+                kwargs["since_id"] = since_id
+            if max_id is not None:
+                kwargs["max_id"] = max_id
+            tweets = self._fetch_timeline(username, **kwargs)
+            if not tweets:
+                return
+            yield tweets
+            max_id = min(tweet.id for tweet in tweets) - 1
+
+    def _get_tweet_photos(self, tweet):
         photos = []
+        try:
+            for m in tweet.extended_entities['media']:
+                if m['type'] == 'photo':
+                    m['text'] = tweet.full_text
+                    photos.append(Photo(parent=self, tweet_json=m))
+        except AttributeError:
+            pass
+        return photos
+
+    def get_timeline(self, username, page, limit, order_latest=False, incremental=False, merge=False):
+        """
+        Get photos in one page of a timeline. With incremental, only tweets
+        newer than the last incremental call are fetched, all of them, limit
+        tweets per request (since_id cursors are kept in conf_folder); merge
+        adds the photos known from earlier calls.
+        """
+        self.db_client.log(type="get_timeline", keyword=username, key=username, text="",
+                           metadata={"page":page, "limit":limit, "incremental":incremental})
+        if incremental:
+            since_id = self.timeline_cursors.get_since_id(username)
+            if since_id:
+                # the cursor moves to the latest tweet, so every tweet up to
+                # it has to be read now or it would never be
+                tweets = [t for page in self._iter_timeline_pages(username, limit, since_id) for t in page]
+            else:
+                tweets = self._fetch_timeline(username, count=limit, page=page)
+        else:
+            tweets = self._fetch_timeline(username, count=limit, page=page)
+        # photos of each tweet, latest tweet first
+        groups = [self._get_tweet_photos(tweet) for tweet in tweets]
+
+        if incremental:
+            known = self.timeline_cursors.get_photos(username)
+            self.timeline_cursors.update(username, max([t.id for t in tweets], default=None),
+                                         [p.to_json() for g in groups for p in g])
+            if merge:
+                groups.extend([Photo(parent=self, tweet_json=m)] for m in known)
         if not order_latest:
-            tweets.reverse()
-        for tweet in tweets:
-            try:
-                for m in tweet.extended_entities['media']:
-                    if m['type'] == 'photo':
-                        m['text'] = tweet.full_text
-                        photos.append(Photo(parent=self, tweet_json=m))
-            except AttributeError:
-                pass
+            groups.reverse()
+        photos = [p for g in groups for p in g]
 
         return PhotoList(photos=photos, source="timeline-"+username, parent=self)
+
+    def iter_timeline_photos(self, username, max_photos=None, limit=200, max_pages=None):
+        """
+        Yield Photos of a timeline, latest first, as each page arrives.
+        Pages are walked back with max_id, so they never overlap; stops once
+        max_photos photos (or max_pages pages) have been produced.
+        """
+        self.db_client.log(type="get_timeline", keyword=username, key=username, text="",
+                           metadata={"max_photos":max_photos, "limit":limit, "max_pages":max_pages})
+        seen = set()
+        pages = 0
+        for tweets in self._iter_timeline_pages(username, limit):
+            for tweet in tweets:
+                for photo in self._get_tweet_photos(tweet):
+                    if photo['id'] in seen:
+                        continue
+                    seen.add(photo['id'])
+                    yield photo
+                    if max_photos and len(seen) >= max_photos:
+                        return
+            pages += 1
+            if max_pages and pages >= max_pages:
+                return
@@ -1,11 +1,187 @@
 import os
+import sys
+import shutil
+import time
 import tempfile
-from tweetpi.photo import ImOp
+import threading
+import collections
+from contextlib import contextmanager
+from tweetpi.cache import FrameCache
+from tweetpi.photo import ImOp, PhotoList, load_font
+from tweetpi.pipeline import Pipeline, Stage, StageTiming
 import subprocess
-from PIL import ImageFont
 
+# worker threads of each stage of pipelined video generation
+DEFAULT_STAGE_WORKERS = {"download": 8, "annotate": 2, "render": 2}
 
-def _generate_video_from_path(files, name, size="1280x720", shell=False, interval=3, parent=None, photos_reference=None):
+# letterbox canvases reused by _render_frame, per thread
+_local = threading.local()
+# caps concurrent ffmpeg processes of this process, see set_max_ffmpeg
+_ffmpeg_slots = None
+
+
+def set_max_ffmpeg(n):
+    """Run at most n ffmpeg processes at a time (None: no limit)"""
+    global _ffmpeg_slots
+    _ffmpeg_slots = threading.BoundedSemaphore(n) if n else None
+
+
+@contextmanager
+def _ffmpeg_slot():
+    slots = _ffmpeg_slots
+    if slots is None:
+        yield
+        return
+    with slots:
+        yield
+
+
+def _get_canvas(width, height):
+    if not hasattr(_local, "canvases"):
+        _local.canvases = {}
+    if (width, height) not in _local.canvases:
+        from PIL import Image
+        _local.canvases[(width, height)] = Image.new('RGB', (width, height))
+    return _local.canvases[(width, height)]
+
+
+def _render_frame(path, size="1280x720", message=None, font_path=None, font_size=40, font_color="rgb(255, 0, 0)",
+                  fill_color=(0, 0, 0), output="raw", filename=None, folder=None):
+    """
+    Render the frame of one image file, possibly in a worker process, so only
+    paths and parameters are passed in. message is drawn if given.
+    output "raw" returns RGB24 bytes, "temp" the path of a JPEG named filename
+    in folder (the temp dir by default); either way the frame is done with
+    before returning, so its canvas is reused.
+    """
+    from PIL import Image
+    width, height = [int(i) for i in size.split('x')]
+    im = ImOp(Image.open(path)).resize(width=width, height=height, fill_color=tuple(fill_color), fast=True,
+                                       canvas=_get_canvas(width, height))
+    if message is not None:
+        im.annotate(message, load_font(font_path, font_size), font_size, font_color)
+    if output == "temp":
+        return im.save_as_temp(filename, folder)
+    return im.get_frame_bytes()
+
+
+def _process_pool(workers):
+    # forked workers would inherit the ffmpeg stdin pipe, so ffmpeg would
+    # never see EOF; forkserver children start from a clean process
+    import multiprocessing
+    from concurrent.futures import ProcessPoolExecutor
+    method = "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else None
+    return ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context(method))
+
+
+# _render_frame arguments that make up a frame cache key
+FRAME_PARAMS = ("size", "message", "font_path", "font_size", "font_color", "fill_color")
+
+
+def _frame_size(job):
+    return tuple(int(i) for i in job["size"].split('x'))
+
+
+class _FrameRenderer:
+    """
+    Renders frames of _render_frame jobs, in executor (a process pool) if
+    given. With frame_cache, frames rendered before with the same parameters
+    are read back instead, and new ones are stored.
+    """
+
+    def __init__(self, executor=None, frame_cache=None):
+        self.executor = executor
+        self.frame_cache = frame_cache
+        self.hits = 0
+        self.misses = 0
+
+    def submit(self, p, job):
+        """Start rendering the frame of p; returns a function returning it"""
+        key = None
+        if self.frame_cache is not None:
+            key = FrameCache.key_for(p.id, **{k: job.get(k) for k in FRAME_PARAMS})
+            frame = self.frame_cache.get_frame(key, _frame_size(job))
+            if frame is not None:
+                self.hits += 1
+                return lambda: self._output(frame, job)
+            self.misses += 1
+
+        raw_job = dict(job, output="raw") if key else job
+        if self.executor:
+            get = self.executor.submit(_render_frame, **raw_job).result
+        else:
+            frame = _render_frame(**raw_job)
+            get = lambda: frame
+
+        def result():
+            if not key:
+                return get()
+            frame = get()
+            self.frame_cache.put_frame(key, frame, _frame_size(job))
+            return self._output(frame, job)
+        return result
+
+    def _output(self, frame, job):
+        if job.get("output") == "temp":
+            from PIL import Image
+            return ImOp(Image.frombytes('RGB', _frame_size(job), frame)).save_as_temp(job.get("filename"), job.get("folder"))
+        return frame
+
+    def print_stats(self, file=sys.stderr):
+        if self.frame_cache is not None:
+            print("Frame cache: {} reused, {} rendered".format(self.hits, self.misses), file=file)
+
+
+def _map_frames(photos, frame_job, workers=1, frame_cache=None, shell=False):
+    """
+    Yield (photo, frame) for each photo, in order. With workers > 1 frames are
+    rendered in a process pool, at most 2 * workers at a time, so they don't
+    pile up ahead of the encoder.
+    """
+    executor = _process_pool(workers) if workers > 1 else None
+    renderer = _FrameRenderer(executor, frame_cache)
+    inflight = collections.deque()
+    try:
+        for p in photos:
+            inflight.append((p, renderer.submit(p, frame_job(p))))
+            if len(inflight) >= max(workers, 1) * 2:
+                p, result = inflight.popleft()
+                yield p, result()
+        while inflight:
+            p, result = inflight.popleft()
+            yield p, result()
+    finally:
+        if executor:
+            executor.shutdown()
+        if frame_cache is not None:
+            frame_cache.save()
+        if shell:
+            renderer.print_stats()
+
+
+def encoder_args(interval=3, slideshow=False, preset=None, crf=None, threads=None):
+    """
+    ffmpeg output options of generated videos. By default photos are encoded
+    at 25 fps, i.e. 25 * interval frames each; slideshow encodes one frame per
+    photo (1/interval fps) tuned for still images. preset and crf are passed
+    to libx264, threads to ffmpeg.
+    """
+    args = ["-c:v", "libx264", "-pix_fmt", "yuv420p"]
+    if slideshow:
+        args += ["-r", "1/{}".format(interval), "-tune", "stillimage"]
+    else:
+        args += ["-r", "25"]
+    if preset:
+        args += ["-preset", preset]
+    if crf is not None:
+        args += ["-crf", str(crf)]
+    if threads:
+        args += ["-threads", str(threads)]
+    return args
+
+
+def _generate_video_from_path(files, name, size="1280x720", shell=False, interval=3, parent=None, photos_reference=None,
+                              encoder=None):
     if parent:
         fullpath = os.path.abspath(name)
     else:
@@ -16,20 +192,22 @@ def _generate_video_from_path(files, name, size="1280x720", shell=False, interva
 
     # generate concat files
     # https://trac.ffmpeg.org/wiki/Slideshow
-    concat_path = os.path.join(tempfile.gettempdir(), name+".txt")
-    with open(concat_path, "w") as concat_file:
+    fd, concat_path = tempfile.mkstemp(suffix=".txt")
+    with os.fdopen(fd, "w") as concat_file:
         for f in files:
             concat_file.write("file '{}'\n".format(f))
             concat_file.write("duration {}\n".format(interval))
     # run
     try:
-        proc = subprocess.run(["ffmpeg", "-f", "concat", "-safe", "0", "-i", concat_path, "-pix_fmt", "yuv420p", "-video_size", size, "-y", "-stats", "-loglevel", "error", name], check=True, stdout=subprocess.PIPE)
+        with _ffmpeg_slot():
+            proc = subprocess.run(["ffmpeg", "-f", "concat", "-safe", "0", "-i", concat_path] + (encoder or encoder_args(interval)) +
+                                  ["-y", "-stats", "-loglevel", "error", name], check=True, stdout=subprocess.PIPE)
     except subprocess.CalledProcessError:
         raise
     finally:
         # unlink temp files
         os.unlink(concat_path)
-        for f in files:
+        for f in set(files):
             os.unlink(f)
         if parent:
             if photos_reference:
@@ -42,49 +220,343 @@ def _generate_video_from_path(files, name, size="1280x720", shell=False, interva
     return fullpath
 
 
-def generate_video(photos, name=None, size="1280x720", shell=False, interval=3, parent=None):
+def _generate_video_from_temp_files(photos, name, frame_job, size="1280x720", shell=False, interval=3, parent=None,
+                                    workers=1, frame_cache=None, encoder=None):
+    # frames go to a folder of this video only, so videos made at the same
+    # time (see tweetpi.batch) from the same photos don't share files
+    folder = tempfile.mkdtemp()
+    try:
+        files = [f for p, f in _map_frames(photos, lambda p: frame_job(p, "temp", folder), workers, frame_cache, shell)]
+        return _generate_video_from_path(files, name, size, shell, interval, parent=parent, photos_reference=photos,
+                                         encoder=encoder)
+    finally:
+        shutil.rmtree(folder, ignore_errors=True)
+
+
+class _FFmpegFrameWriter:
     """
-    Generate a simple video
-    photos: PhotoList
+    ffmpeg reading raw RGB24 frames of size from stdin, each shown for
+    interval seconds; no temp files involved. Holds an ffmpeg slot (see
+    set_max_ffmpeg) until closed.
     """
-    if not name:
-        name = photos.source+".mp4"
-    sizes = size.split('x')
 
-    d = photos.download_all(shell=shell, force=False)
-    if not d:
-        return False
-    files = []
+    def __init__(self, name, size="1280x720", interval=3, encoder=None):
+        self.name = name
+        self.frames = 0
+        self._slots = _ffmpeg_slots
+        if self._slots:
+            self._slots.acquire()
+        try:
+            self.proc = subprocess.Popen(["ffmpeg", "-f", "rawvideo", "-pix_fmt", "rgb24", "-video_size", size,
+                                          "-framerate", "1/{}".format(interval), "-i", "-"] +
+                                         (encoder or encoder_args(interval)) + ["-y", "-stats", "-loglevel", "error", name],
+                                         stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+        except BaseException:
+            if self._slots:
+                self._slots.release()
+            raise
 
-    for p in photos:
-        im = ImOp(p).resize(width=int(sizes[0]), height=int(sizes[1]))
-        files.append(im.save_as_temp(p.name))
+    def write(self, frame):
+        try:
+            self.proc.stdin.write(frame)
+        except BrokenPipeError:
+            # ffmpeg exited; close() reports its return code
+            pass
+        self.frames += 1
 
-    return _generate_video_from_path(files, name, size, shell, interval, parent=parent, photos_reference=photos)
+    def close(self):
+        try:
+            self.proc.stdin.close()
+        except BrokenPipeError:
+            pass
+        try:
+            returncode = self.proc.wait()
+        finally:
+            if self._slots:
+                self._slots.release()
+        if returncode:
+            raise subprocess.CalledProcessError(returncode, "ffmpeg")
 
 
-def generate_annotated_video(photos, name=None, size="1280x720", shell=False, interval=3,
-                             font_file="Roboto-Regular.ttf", font_color="rgb(255, 0, 0)", font_size=40, parent=None):
+def _generate_video_from_frames(frames, name, size="1280x720", shell=False, interval=3, parent=None, encoder=None):
+    """
+    Encode frames, an iterable of (Photo, RGB24 bytes) consumed lazily, by
+    piping them into ffmpeg; each frame is released as soon as it is written.
+    """
+    fullpath = os.path.abspath(name)
+    writer = None
+    encoded = []
+    try:
+        for p, frame in frames:
+            if writer is None:
+                # started on the first frame, so that no frames leave no output
+                writer = _FFmpegFrameWriter(name, size, interval, encoder)
+            writer.write(frame)
+            encoded.append(p)
+    finally:
+        if writer is not None:
+            try:
+                writer.close()
+            finally:
+                if parent:
+                    parent.db_client.log(type="video", keyword="",
+                                         key=name, text="", metadata={"photos":[i.remote_url for i in encoded]})
+    if not encoded:
+        raise Exception("No images available for video creation")
+    return fullpath
+
+
+# frame rate a segment's still is repeated at, before the output -r applies
+SEGMENT_FPS = 25
+
+
+def _segment_key(p, job, interval, encoder):
+    # every segment of a video must be encoded alike to be joined with -c copy
+    return FrameCache.key_for(p.id, interval=interval, fps=SEGMENT_FPS, encoder=encoder,
+                              **{k: job.get(k) for k in FRAME_PARAMS})
+
+
+def _encode_segment(frame, size, interval, path, encoder):
+    """Encode one RGB24 frame into a clip of interval seconds at path"""
+    with _ffmpeg_slot():
+        subprocess.run(["ffmpeg", "-f", "rawvideo", "-pix_fmt", "rgb24", "-video_size", size,
+                        "-framerate", str(SEGMENT_FPS), "-i", "-",
+                        "-vf", "loop=loop={}:size=1:start=0".format(round(interval * SEGMENT_FPS) - 1)] +
+                       encoder + ["-y", "-loglevel", "error", path],
+                       input=frame, check=True, stdout=subprocess.PIPE)
+
+
+def _generate_video_from_segments(photos, name, frame_job, size="1280x720", shell=False, interval=3, parent=None,
+                                  workers=1, frame_cache=None, encoder=None):
+    """
+    Encode each photo into its own clip, kept in parent.segment_cache, then
+    join the clips with ffmpeg's concat demuxer and stream copy. Only photos
+    without a cached clip (e.g. new in the timeline) are rendered and encoded.
+    """
+    if not len(photos):
+        raise Exception("No images available for video creation")
+    segment_cache = parent.segment_cache
+    encoder = encoder or encoder_args(interval)
+    keys = [_segment_key(p, frame_job(p), interval, encoder) for p in photos]
+    missing = [(p, key) for p, key in zip(photos, keys) if not segment_cache.get(key)]
+
+    def _encode(p, key, frame):
+        fd, tmp_path = tempfile.mkstemp(dir=segment_cache.folder, suffix=".mp4")
+        os.close(fd)
+        try:
+            _encode_segment(frame, size, interval, tmp_path, encoder)
+            return segment_cache.put(key, tmp_path, ".mp4")
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+
+    for p, frame in _map_frames([p for p, key in missing], frame_job, workers, frame_cache, shell):
+        _encode(p, _segment_key(p, frame_job(p), interval, encoder), frame)
+    if shell:
+        print("Segments: {} reused, {} encoded".format(len(photos) - len(missing), len(missing)), file=sys.stderr)
+
+    fd, concat_path = tempfile.mkstemp(suffix=".txt")
+    try:
+        with os.fdopen(fd, "w") as concat_file:
+            for p, key in zip(photos, keys):
+                path = segment_cache.get(key)
+                if not path:
+                    # evicted while this video was being encoded
+                    path = _encode(p, key, list(_map_frames([p], frame_job, 1, frame_cache))[0][1])
+                concat_file.write("file '{}'\n".format(os.path.abspath(path)))
+        segment_cache.save()
+        with _ffmpeg_slot():
+            subprocess.run(["ffmpeg", "-f", "concat", "-safe", "0", "-i", concat_path, "-c", "copy",
+                            "-y", "-stats", "-loglevel", "error", name], check=True, stdout=subprocess.PIPE)
+    finally:
+        os.unlink(concat_path)
+        parent.db_client.log(type="video", keyword="",
+                             key=name, text="", metadata={"photos":[i.remote_url for i in photos]})
+    return os.path.abspath(name)
+
+
+def _generate_video_pipelined(photos, name, frame_job, size="1280x720", shell=False, interval=3, parent=None,
+                              annotate=False, inline_annotation=True, stage_workers=None, queue_size=16, timings=None,
+                              workers=1, frame_cache=None, encoder=None):
+    """
+    Stream photos through download -> (annotate ->) render -> encode stages
+    connected by bounded queues, so that a photo is rendered and piped into
+    ffmpeg as soon as it is ready, while others are still in flight.
+    photos may be any iterable, e.g. TweetPI.iter_timeline_photos(), which
+    then runs as the fetch stage. Photos failing a stage are left out; they
+    are printed with shell and listed in timings["errors"] as (stage,
+    photo, exception), photo being None if the fetch stage failed.
+    frame_job(photo) returns the _render_frame arguments of its frame; with
+    workers > 1 frames are rendered in a process pool, and with frame_cache
+    unchanged frames are reused.
+    """
+    stage_workers = dict(DEFAULT_STAGE_WORKERS, **(stage_workers or {}))
+    executor = None
+    if workers > 1:
+        executor = _process_pool(workers)
+        # render threads only wait for the pool
+        stage_workers["render"] = max(stage_workers["render"], workers)
+    renderer = _FrameRenderer(executor, frame_cache)
+
+    def _render(p):
+        return p, renderer.submit(p, frame_job(p))()
+
+    def _download(p):
+        try:
+            p.download(force=False)
+        except Exception:
+            print("Failed: {}".format(p.remote_url), file=sys.stderr)
+            raise
+        if shell:
+            print("Downloaded: {}".format(p.remote_url), file=sys.stderr)
+        return p
+
+    def _annotate(batch):
+        PhotoList(batch, parent=batch[0].parent).fetch_annotations(
+            batch_size=len(batch), max_workers=1, inline=inline_annotation)
+        return batch
+
+    stages = [Stage("download", _download, stage_workers["download"])]
+    if annotate:
+        stages.append(Stage("annotate", _annotate, stage_workers["annotate"], batch_size=16))
+    stages.append(Stage("render", _render, stage_workers["render"]))
+    # the encode stage is the ordered consumer below
+    pl = Pipeline(stages, queue_size=queue_size, source_name="fetch")
+    encode = StageTiming("encode")
+
+    fed = []
+
+    def _fetch():
+        for p in photos:
+            fed.append(p)
+            yield p
+
+    def _frames():
+        for p, frame in pl.run(_fetch()):
+            start = time.perf_counter()
+            yield p, frame
+            encode.add(start, time.perf_counter(), 1)
+
+    try:
+        return _generate_video_from_frames(_frames(), name, size, shell, interval, parent=parent, encoder=encoder)
+    finally:
+        if executor:
+            executor.shutdown()
+        if frame_cache is not None:
+            frame_cache.save()
+        pl.timings["encode"] = encode
+        errors = [(stage, fed[i] if i < len(fed) else None, e) for stage, i, e in pl.errors]
+        if timings is not None:
+            timings.update(pl.get_timings())
+            timings["errors"] = errors
+        if shell:
+            for stage, p, e in errors:
+                print("Left out {} ({} failed): {}".format(p.remote_url if p else "the rest", stage, e), file=sys.stderr)
+            pl.print_timings()
+            renderer.print_stats()
+
+
+def generate_video(photos, name=None, size="1280x720", shell=False, interval=3, parent=None, collapse_duplicates=False,
+                   pipeline=False, stage_workers=None, timings=None, stream=False, workers=1, cache_frames=False,
+                   segments=False, slideshow=False, preset=None, crf=None, threads=None):
+    """
+    Generate a simple video
+    photos: PhotoList
+    collapse_duplicates: show only the first of near-duplicate photos
+    pipeline: overlap download, render and encode (see _generate_video_pipelined);
+        stage_workers overrides DEFAULT_STAGE_WORKERS, timings (a dict) receives
+        per-stage timings; collapse_duplicates and dedup need every photo
+        downloaded first, so they don't apply
+    stream: pipe frames straight into ffmpeg instead of writing temp JPEG
+        files (always the case with pipeline)
+    workers: render frames in this many processes; frames keep photos' order
+    cache_frames: keep rendered frames in parent.frame_cache and reuse those
+        of earlier runs; worth it when the same photos are rendered again
+    segments: encode each photo into a clip kept in parent.segment_cache and
+        join them without re-encoding, so a timeline that gained photos only
+        encodes the new ones (needs parent)
+    slideshow, preset, crf, threads: encoder settings, see encoder_args
+    """
+    if segments and not parent:
+        raise ValueError("segments=True needs parent, whose segment_cache keeps the clips")
     if not name:
-        name = photos.source+".mp4"
-    sizes = size.split('x')
+        name = getattr(photos, "source", "timeline")+".mp4"
+
+    def _frame_job(p, output="raw", folder=None):
+        return {"path": p.get_local_path(), "size": size, "output": output, "filename": p.name, "folder": folder}
+
+    frame_cache = parent.frame_cache if parent and cache_frames else None
+    encoder = encoder_args(interval, slideshow, preset, crf, threads)
+    if pipeline:
+        return _generate_video_pipelined(photos, name, _frame_job, size, shell, interval, parent=parent,
+                                         stage_workers=stage_workers, timings=timings, workers=workers,
+                                         frame_cache=frame_cache, encoder=encoder)
 
     d = photos.download_all(shell=shell, force=False)
     if not d:
         return False
+    if collapse_duplicates:
+        photos = photos.collapse_near_duplicates()
+    if segments:
+        return _generate_video_from_segments(photos, name, _frame_job, size, shell, interval, parent=parent,
+                                             workers=workers, frame_cache=frame_cache, encoder=encoder)
+    if stream:
+        frames = _map_frames(photos, _frame_job, workers, frame_cache, shell)
+        return _generate_video_from_frames(frames, name, size, shell, interval, parent=parent, encoder=encoder)
+    return _generate_video_from_temp_files(photos, name, _frame_job, size, shell, interval, parent=parent,
+                                           workers=workers, frame_cache=frame_cache, encoder=encoder)
 
-    photos.fetch_annotations()
-    files = []
+
+def generate_annotated_video(photos, name=None, size="1280x720", shell=False, interval=3,
+                             font_file="Roboto-Regular.ttf", font_color="rgb(255, 0, 0)", font_size=40, parent=None,
+                             collapse_duplicates=False, dedup=False, inline_annotation=True,
+                             pipeline=False, stage_workers=None, timings=None, stream=False, workers=1, cache_frames=False,
+                             segments=False, slideshow=False, preset=None, crf=None, threads=None):
+    """
+    Generate a video with annotations drawn on each photo
+    photos: PhotoList
+    collapse_duplicates: show only the first of near-duplicate photos
+    dedup: near-duplicate photos share one annotation request
+    inline_annotation: send downscaled local copies to Vision instead of URLs
+    pipeline, stage_workers, timings, stream, workers, cache_frames, segments,
+    slideshow, preset, crf, threads: see generate_video
+    """
+    if segments and not parent:
+        raise ValueError("segments=True needs parent, whose segment_cache keeps the clips")
+    if not name:
+        name = getattr(photos, "source", "timeline")+".mp4"
     if parent:
         conf_path = parent.conf_folder
     else:
         conf_path = ""
-    font = ImageFont.truetype(os.path.join(conf_path, font_file), size=font_size)
+    font_path = os.path.join(conf_path, font_file)
+    # fail early on a missing font
+    load_font(font_path, font_size)
+
+    def _frame_job(p, output="raw", folder=None):
+        return {"path": p.get_local_path(), "size": size, "message": ", ".join(p.labels), "font_path": font_path,
+                "font_size": font_size, "font_color": font_color, "output": output, "filename": p.name,
+                "folder": folder}
+
+    frame_cache = parent.frame_cache if parent and cache_frames else None
+    encoder = encoder_args(interval, slideshow, preset, crf, threads)
+    if pipeline:
+        return _generate_video_pipelined(photos, name, _frame_job, size, shell, interval, parent=parent, annotate=True,
+                                         inline_annotation=inline_annotation, stage_workers=stage_workers, timings=timings,
+                                         workers=workers, frame_cache=frame_cache, encoder=encoder)
 
-    for p in photos:
-        message = ", ".join([l.description for l in p.annotation.label_annotations])
-        im = ImOp(p).resize(width=int(sizes[0]), height=int(sizes[1]))
-        im.annotate(message, font, font_size, font_color)
-        files.append(im.save_as_temp(p.name))
+    d = photos.download_all(shell=shell, force=False)
+    if not d:
+        return False
+    if collapse_duplicates:
+        photos = photos.collapse_near_duplicates()
 
-    return _generate_video_from_path(files, name, size, shell, interval, parent=parent, photos_reference=photos)
+    photos.fetch_annotations(dedup=dedup, inline=inline_annotation)
+    if segments:
+        return _generate_video_from_segments(photos, name, _frame_job, size, shell, interval, parent=parent,
+                                             workers=workers, frame_cache=frame_cache, encoder=encoder)
+    if stream:
+        frames = _map_frames(photos, _frame_job, workers, frame_cache, shell)
+        return _generate_video_from_frames(frames, name, size, shell, interval, parent=parent, encoder=encoder)
+    return _generate_video_from_temp_files(photos, name, _frame_job, size, shell, interval, parent=parent,
+                                           workers=workers, frame_cache=frame_cache, encoder=encoder)